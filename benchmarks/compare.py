@@ -0,0 +1,62 @@
+import argparse
+import json
+
+#Metrics where a larger value is an improvement, everything else is a time or a size
+HIGHER_IS_BETTER = ('throughput_qps',)
+
+def metrics(report):
+    values = {}
+    for name, stage in report.get("stages", {}).items():
+        values[f"stage.{name}.wall_s"] = stage["wall_s"]
+        values[f"stage.{name}.peak_rss_mb"] = stage["peak_rss_mb"]
+    query = report.get("query")
+    if query:
+        values["query.throughput_qps"] = query["throughput_qps"]
+        for metric in ("search_ms", "first_token_ms", "total_ms"):
+            for percentile in ("p50", "p95", "p99"):
+                if percentile in query[metric]:
+                    values[f"query.{metric}.{percentile}"] = query[metric][percentile]
+    if "server" in report:
+        values["server.peak_rss_mb"] = report["server"]["peak_rss_mb"]
+    return values
+
+def compare(base, head, threshold):
+    rows, regressions = [], []
+    base_values, head_values = metrics(base), metrics(head)
+    for name in base_values:
+        if name not in head_values or not base_values[name]:
+            continue
+        change = (head_values[name] - base_values[name]) / base_values[name]
+        worse = -change if name.endswith(HIGHER_IS_BETTER) else change
+        rows.append((name, base_values[name], head_values[name], change, worse > threshold))
+        if worse > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare two run_benchmark.py reports and flag regressions")
+    parser.add_argument("base", help="report from the reference commit")
+    parser.add_argument("head", help="report from the commit under test")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown counted as a regression")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    with open(args.base) as file:
+        base = json.load(file)
+    with open(args.head) as file:
+        head = json.load(file)
+
+    if base.get("config", {}).get("papers") != head.get("config", {}).get("papers"):
+        print("Warning: the reports were run on different corpus sizes")
+    print(f"{(base.get('commit') or '?')[:12]} -> {(head.get('commit') or '?')[:12]}")
+    rows, regressions = compare(base, head, args.threshold)
+    for name, before, after, change, regressed in rows:
+        print(f"{name:<32} {before:12.2f} {after:12.2f} {change:+8.1%}{'  REGRESSION' if regressed else ''}")
+
+    if regressions:
+        raise SystemExit(f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}")
+    print("No regressions")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+import requests
+
+#The query path as Ask Jim runs it: retrieval_client for sources, AnswerStream for the answer
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "streamlit_visuals"))
+
+import retrieval_client
+from llm import AnswerStream
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    values = np.asarray(values)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "mean": float(values.mean()), "p50": float(p50), "p95": float(p95),
+            "p99": float(p99), "max": float(values.max())}
+
+def ask(question, args):
+    #One Ask Jim question end to end, latencies in milliseconds
+    start = time.perf_counter()
+    response = retrieval_client.search_details(question, args.k, args.mode, rerank=args.rerank)
+    searched = time.perf_counter()
+    stream = AnswerStream(response["results"], question)
+    for _ in stream:
+        pass
+    done = time.perf_counter()
+    return {
+        "search_ms": (searched - start) * 1000,
+        "first_token_ms": (searched - start + (stream.first_token_s or stream.total_s)) * 1000,
+        "answer_ms": (done - searched) * 1000,
+        "total_ms": (done - start) * 1000,
+        "server_ms": response["took_ms"],
+        "timings": response["timings"],
+    }
+
+def client_loop(questions, deadline, args, samples, errors, lock):
+    #Closed loop: each client sends its next question as soon as the previous answer is complete
+    while time.perf_counter() < deadline:
+        with lock:
+            question = next(questions)
+        try:
+            sample = ask(question, args)
+        except requests.HTTPError as e:
+            kind = "rejected" if e.response is not None and e.response.status_code == 503 else "http_error"
+            with lock:
+                errors[kind] = errors.get(kind, 0) + 1
+            continue
+        except Exception as e:
+            with lock:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            continue
+        with lock:
+            samples.append(sample)
+
+def run_load(questions, args):
+    #Enough pooled connections that clients never queue for a socket
+    retrieval_client.session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.clients))
+    for question in questions[:args.warmup]:
+        ask(question, args)
+
+    samples, errors, lock = [], {}, threading.Lock()
+    cycle = itertools.cycle(questions[args.warmup:] or questions)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    clients = [threading.Thread(target=client_loop, args=(cycle, deadline, args, samples, errors, lock))
+               for _ in range(args.clients)]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - start
+
+    stages = {}
+    for sample in samples:
+        for stage, ms in sample["timings"].items():
+            stages.setdefault(stage, []).append(ms)
+    return {
+        "clients": args.clients,
+        "duration_s": elapsed,
+        "completed": len(samples),
+        "errors": errors,
+        "throughput_qps": len(samples) / elapsed,
+        **{metric: summarize([sample[metric] for sample in samples])
+           for metric in ("search_ms", "first_token_ms", "answer_ms", "total_ms", "server_ms")},
+        "server_stages": {stage: summarize(values) for stage, values in stages.items()},
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Closed-loop load test of the Ask Jim query path (retrieval server and Ollama)")
+    parser.add_argument("questions", help="text file with one question per line")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent users, each waits for its answer before asking again")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured load")
+    parser.add_argument("--warmup", type=int, default=10, help="questions asked one at a time before measuring")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--mode", choices=['hybrid', 'dense', 'lexical'], default='hybrid')
+    parser.add_argument("--rerank", action=argparse.BooleanOptionalAction, default=None,
+                        help="force reranking on or off, the server decides by default")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    with open(args.questions) as file:
+        questions = [line.strip() for line in file if line.strip()]
+    if not retrieval_client.health():
+        raise SystemExit(f"No retrieval server at {retrieval_client.RETRIEVAL_URL}")
+
+    report = run_load(questions, args)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
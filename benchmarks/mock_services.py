@@ -0,0 +1,101 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+#Stand-ins for Crossref and Ollama with a fixed, configurable latency, so benchmark numbers measure this repo's code
+
+class CrossrefHandler(BaseHTTPRequestHandler):
+    latency = 0.02
+    miss_rate = 0.1
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        title = parse_qs(urlparse(self.path).query).get("query.bibliographic", [""])[0]
+        digest = hashlib.blake2b(title.encode('utf-8'), digest_size=8).digest()
+        #Deterministic per title, so reruns find the same DOIs
+        items = []
+        if int.from_bytes(digest[:2], 'big') / 65536 >= self.miss_rate:
+            items.append({"DOI": f"10.5555/crossref.{digest.hex()}", "title": [title]})
+        body = json.dumps({"status": "ok", "message": {"items": items}}).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class OllamaHandler(BaseHTTPRequestHandler):
+    #Chunked NDJSON like the real /api/chat, the ollama client parses it unchanged
+    protocol_version = "HTTP/1.1"
+    first_token = 0.2
+    token_delay = 0.01
+    tokens = 64
+
+    def send_chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode('utf-8')
+        self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt = " ".join(message.get("content", "") for message in request.get("messages", []))
+        words = [f"word{i}" for i in range(self.tokens)]
+        done = {"model": request.get("model", ""), "done": True,
+                "prompt_eval_count": len(prompt.split()), "eval_count": self.tokens}
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(self.first_token)
+        if request.get("stream", True):
+            for word in words:
+                self.send_chunk({"model": done["model"], "message": {"role": "assistant", "content": word + " "}, "done": False})
+                time.sleep(self.token_delay)
+            self.send_chunk({**done, "message": {"role": "assistant", "content": ""}})
+        else:
+            time.sleep(self.token_delay * self.tokens)
+            self.send_chunk({**done, "message": {"role": "assistant", "content": " ".join(words)}})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+def start(handler, host="127.0.0.1", port=0, **settings):
+    #Serves on a daemon thread, port 0 picks a free one, settings override the handler's class attributes
+    handler = type(handler.__name__, (handler,), settings)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the mock Crossref and Ollama servers used by the benchmarks")
+    parser.add_argument("--crossref-port", type=int, default=8801)
+    parser.add_argument("--ollama-port", type=int, default=11435)
+    parser.add_argument("--crossref-latency-ms", type=float, default=20)
+    parser.add_argument("--first-token-ms", type=float, default=200)
+    parser.add_argument("--token-ms", type=float, default=10)
+    parser.add_argument("--tokens", type=int, default=64)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    _, crossref_url = start(CrossrefHandler, port=args.crossref_port, latency=args.crossref_latency_ms / 1000)
+    _, ollama_url = start(OllamaHandler, port=args.ollama_port, first_token=args.first_token_ms / 1000,
+                          token_delay=args.token_ms / 1000, tokens=args.tokens)
+    print(f"CROSSREF_URL={crossref_url}/works")
+    print(f"OLLAMA_HOST={ollama_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
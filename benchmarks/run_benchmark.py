@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+import mock_services
+from synthetic_corpus import write_corpus, make_questions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "data", "benchmarks")
+MODEL_NAME = 'all-mpnet-base-v2'
+
+def stage_commands(args, work):
+    #(name, directory, script arguments) in pipeline order, every output lands in the work directory
+    return [
+        ('ingest', 'data_preparation', ['data_extraction.py', '--workers', str(args.workers)]),
+        ('doi', 'data_preparation', ['fetch_doi.py', '--workers', '8', '--rate', '1000',
+                                     '--cache', os.path.join(work, 'doi_cache.db'), '--csv', '']),
+        ('fts', 'data_preparation', ['build_fts.py']),
+        ('aggregates', 'data_preparation', ['build_aggregates.py']),
+        ('embed', 'model_creation', ['embed.py', '--model', args.model, '--store', os.path.join(work, 'embeddings')]),
+        ('index', 'model_creation', ['build_index.py', '--type', args.index_type, '--store', os.path.join(work, 'embeddings'),
+                                     '--output', os.path.join(work, 'index.idx'), '--eval-queries', '0']),
+        ('cluster', 'model_creation', ['cluster_papers.py', '--store', os.path.join(work, 'embeddings'),
+                                       '--k-max', str(args.k_max), '--sweep-output', os.path.join(work, 'cluster_sweep.json'),
+                                       '--centroids', os.path.join(work, 'cluster_centroids.npy')]),
+        ('project', 'model_creation', ['topic_clustering.py', 'fit', '--backend', args.projection_backend,
+                                       '--store', os.path.join(work, 'embeddings'), '--model', os.path.join(work, 'projection.pkl')]),
+        ('label', 'model_creation', ['label_clusters.py', '--workers', '8']),
+        ('metadata', 'model_creation', ['build_metadata_store.py', '--labels', '', '--output', os.path.join(work, 'metadata.arrow')]),
+    ]
+
+def run_stage(name, directory, command, env, log_dir):
+    #wait4 returns the stage's rusage, ru_maxrss covers the largest process in its tree, in KiB on Linux
+    log_path = os.path.join(log_dir, f"{name}.log")
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        process = subprocess.Popen([sys.executable] + command, cwd=os.path.join(ROOT, directory), env=env,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "wall_s": time.perf_counter() - start,
+        "user_s": usage.ru_utime,
+        "sys_s": usage.ru_stime,
+        "peak_rss_mb": peak_rss_mb(usage),
+        "returncode": process.returncode,
+        "log": log_path,
+    }
+
+def peak_rss_mb(usage):
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(args, work, env, log_dir):
+    port = free_port()
+    command = [sys.executable, 'retrieval_server.py', '--port', str(port), '--index', os.path.join(work, 'index.idx'),
+               '--metadata', os.path.join(work, 'metadata.arrow'), '--model', args.model, '--cache', '', '--reload-interval', '0']
+    if args.rerank_model is not None:
+        command += ['--rerank-model', args.rerank_model]
+    log = open(os.path.join(log_dir, "server.log"), "w")
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=os.path.join(ROOT, 'streamlit_visuals'), env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{port}"
+    while process.poll() is None:
+        try:
+            if requests.get(f"{url}/health", timeout=1).ok:
+                return process, url, time.perf_counter() - start
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"Retrieval server exited with {process.returncode}, see {log.name}")
+
+def stop_server(process):
+    #SIGINT lets serve_forever return, so the server exits normally and wait4 reports its peak memory
+    process.send_signal(signal.SIGINT)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return peak_rss_mb(usage)
+
+def git_revision():
+    def git(*command):
+        return subprocess.run(['git', *command], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return {"commit": git('rev-parse', 'HEAD') or None, "dirty": bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on a synthetic corpus, then load test the query path")
+    parser.add_argument("--papers", type=int, default=10000, help="synthetic corpus size")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="ingest parser processes")
+    parser.add_argument("--model", default=MODEL_NAME, help="sentence-transformers model for embedding and queries")
+    parser.add_argument("--index-type", default='hnsw', choices=['flat', 'ivf_flat', 'ivf_pq', 'hnsw'])
+    parser.add_argument("--k-max", type=int, default=50, help="largest k in the clustering sweep")
+    parser.add_argument("--projection-backend", default='umap', choices=['umap', 'opentsne', 'sklearn'])
+    parser.add_argument("--rerank-model", help="cross-encoder for the server, empty disables reranking (default: server default)")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent users in the load test, 0 skips it")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of measured load")
+    parser.add_argument("--crossref-latency-ms", type=float, default=20)
+    parser.add_argument("--first-token-ms", type=float, default=200, help="mock Ollama time to first token")
+    parser.add_argument("--token-ms", type=float, default=10, help="mock Ollama time per generated token")
+    parser.add_argument("--tokens", type=int, default=64, help="tokens per mock answer")
+    parser.add_argument("--workdir", help="keep the corpus, database and models here instead of a temporary directory")
+    parser.add_argument("--output", help=f"JSON report, defaults to {os.path.relpath(RESULTS_DIR, ROOT)}/<commit>.json")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    work = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="askjim-bench-")
+    if os.path.exists(os.path.join(work, 'papers.db')):
+        raise SystemExit(f"{work} already holds a benchmark run, pick an empty --workdir")
+    log_dir = os.path.join(work, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+
+    _, crossref_url = mock_services.start(mock_services.CrossrefHandler, latency=args.crossref_latency_ms / 1000)
+    _, ollama_url = mock_services.start(mock_services.OllamaHandler, first_token=args.first_token_ms / 1000,
+                                        token_delay=args.token_ms / 1000, tokens=args.tokens)
+    #Absolute paths win over the repo .env, load_dotenv never overrides variables that are already set
+    env = dict(os.environ, SQLITE_DB_PATH=os.path.join(work, 'papers.db'), SCOPUS_DATA_PATH=os.path.join(work, 'corpus'),
+               EMBEDDINGS_DIR=os.path.join(work, 'embeddings'), CROSSREF_URL=f"{crossref_url}/works",
+               OLLAMA_HOST=ollama_url, PYTHONUNBUFFERED="1")
+
+    revision = git_revision()
+    report = {
+        **revision,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": {key: value for key, value in vars(args).items() if key not in ('workdir', 'output')},
+        "stages": {},
+    }
+
+    print(f"Generating {args.papers} synthetic papers in {work}...")
+    start = time.perf_counter()
+    corpus_bytes = write_corpus(os.path.join(work, 'corpus'), args.papers, args.seed)
+    report["corpus"] = {"papers": args.papers, "bytes": corpus_bytes, "generate_s": time.perf_counter() - start}
+
+    failed = None
+    for name, directory, command in stage_commands(args, work):
+        result = run_stage(name, directory, command, env, log_dir)
+        report["stages"][name] = result
+        print(f"{name:>10}: {result['wall_s']:8.2f}s  peak RSS {result['peak_rss_mb']:8.1f} MB")
+        if result["returncode"] != 0:
+            failed = name
+            print(f"{name} failed with exit code {result['returncode']}, see {result['log']}")
+            break
+
+    if failed is None and args.clients > 0:
+        questions_path = os.path.join(work, 'questions.txt')
+        with open(questions_path, "w") as file:
+            file.write("\n".join(make_questions(1000, args.seed)))
+
+        print(f"Load testing the query path with {args.clients} clients for {args.duration:.0f}s...")
+        server, url, startup_s = start_server(args, work, env, log_dir)
+        try:
+            query_path = os.path.join(work, 'query.json')
+            load = subprocess.run([sys.executable, os.path.join(ROOT, 'benchmarks', 'load_test.py'), questions_path,
+                                   '--clients', str(args.clients), '--duration', str(args.duration), '--output', query_path],
+                                  env=dict(env, RETRIEVAL_URL=url))
+            if load.returncode == 0:
+                with open(query_path) as file:
+                    report["query"] = json.load(file)
+            else:
+                failed = 'query'
+        finally:
+            report["server"] = {"startup_s": startup_s, "peak_rss_mb": stop_server(server)}
+
+        if "query" in report:
+            query = report["query"]
+            print(f"{query['completed']} questions, {query['throughput_qps']:.1f}/s, end to end p50 "
+                  f"{query['total_ms']['p50']:.0f}ms p95 {query['total_ms']['p95']:.0f}ms p99 {query['total_ms']['p99']:.0f}ms, "
+                  f"server peak RSS {report['server']['peak_rss_mb']:.1f} MB")
+
+    report["failed"] = failed
+    output = args.output or os.path.join(RESULTS_DIR, f"{(revision['commit'] or 'unknown')[:12]}{'-dirty' if revision['dirty'] else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Wrote {output}")
+
+    #A failed run keeps its work directory for the stage logs
+    if not args.workdir and not failed:
+        shutil.rmtree(work, ignore_errors=True)
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import json
+import os
+import random
+
+#Each topic draws its words from its own vocabulary, so embeddings, clusters and BM25 have real structure to find
+TOPICS = {
+    'Computer Science': ['neural', 'network', 'learning', 'transformer', 'graph', 'algorithm', 'distributed', 'compiler',
+                         'retrieval', 'embedding', 'optimization', 'inference', 'dataset', 'benchmark', 'latency'],
+    'Medicine': ['patients', 'clinical', 'trial', 'cohort', 'therapy', 'diagnosis', 'cancer', 'diabetes',
+                 'mortality', 'hospital', 'vaccine', 'treatment', 'symptoms', 'risk', 'screening'],
+    'Engineering': ['structural', 'concrete', 'load', 'vibration', 'sensor', 'control', 'robot', 'turbine',
+                    'thermal', 'fatigue', 'welding', 'actuator', 'bridge', 'simulation', 'design'],
+    'Chemistry': ['catalyst', 'synthesis', 'polymer', 'oxidation', 'molecule', 'reaction', 'spectroscopy', 'solvent',
+                  'nanoparticle', 'electrode', 'crystal', 'ligand', 'adsorption', 'membrane', 'yield'],
+    'Environmental Science': ['climate', 'emission', 'water', 'pollution', 'soil', 'biodiversity', 'carbon', 'rainfall',
+                              'wastewater', 'forest', 'microplastic', 'air', 'sediment', 'drought', 'urban'],
+    'Physics': ['quantum', 'laser', 'photon', 'magnetic', 'superconducting', 'plasma', 'spin', 'lattice',
+                'semiconductor', 'optical', 'entanglement', 'particle', 'wave', 'detector', 'cosmic'],
+}
+COMMON = ['study', 'analysis', 'approach', 'method', 'results', 'effect', 'model', 'evaluation', 'novel', 'performance']
+JOURNALS = {
+    'Computer Science': ['IEEE Access', 'Expert Systems with Applications', 'Neurocomputing'],
+    'Medicine': ['The Lancet', 'BMJ Open', 'PLoS ONE'],
+    'Engineering': ['Engineering Structures', 'Mechatronics', 'PLoS ONE'],
+    'Chemistry': ['Journal of Catalysis', 'Polymer', 'RSC Advances'],
+    'Environmental Science': ['Science of the Total Environment', 'Water Research', 'PLoS ONE'],
+    'Physics': ['Physical Review B', 'Optics Express', 'Scientific Reports'],
+}
+SURNAMES = ['Srisuk', 'Wongsa', 'Chaiyo', 'Smith', 'Tanaka', 'Nguyen', 'Kim', 'Garcia', 'Muller', 'Rossi',
+            'Suksawat', 'Boonmee', 'Chen', 'Wang', 'Patel', 'Jones', 'Silva', 'Ivanov', 'Larsen', 'Dubois']
+AFFILIATIONS = [('Chulalongkorn University', 'Thailand'), ('Mahidol University', 'Thailand'),
+                ('Kasetsart University', 'Thailand'), ('University of Tokyo', 'Japan'), ('MIT', 'United States'),
+                ('Tsinghua University', 'China'), ('ETH Zurich', 'Switzerland'), ('University of Oxford', 'United Kingdom'),
+                ('National University of Singapore', 'Singapore'), ('KAIST', 'South Korea')]
+YEARS = [2018, 2019, 2020, 2021, 2022, 2023]
+
+def sentence(rng, words, length):
+    text = " ".join(rng.choice(words) for _ in range(length))
+    return text[0].upper() + text[1:] + "."
+
+def make_paper(rng, year, doi_rate):
+    subject = rng.choice(list(TOPICS))
+    subjects = [subject] + rng.sample([other for other in TOPICS if other != subject], int(rng.random() < 0.3))
+    words = TOPICS[subject] * 3 + COMMON
+    title = sentence(rng, words, rng.randint(6, 12))[:-1]
+    abstract = " ".join(sentence(rng, words, rng.randint(12, 25)) for _ in range(rng.randint(4, 9)))
+
+    affiliations = [{'affilname': name, 'affiliation-country': country}
+                    for name, country in rng.sample(AFFILIATIONS, rng.randint(1, 3))]
+    coredata = {
+        'dc:title': title,
+        'dc:description': abstract,
+        'prism:coverDate': f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        'prism:publicationName': rng.choice(JOURNALS[subject]),
+        'citedby-count': str(int(rng.paretovariate(1.2)) - 1),
+    }
+    #Papers without a DOI are what fetch_doi.py resolves
+    if rng.random() < doi_rate:
+        coredata['prism:doi'] = f"10.5555/synthetic.{year}.{rng.getrandbits(40):x}"
+
+    return {'abstracts-retrieval-response': {
+        'coredata': coredata,
+        'subject-areas': {'subject-area': [{'$': name, '@abbrev': name[:4].upper()} for name in subjects]},
+        'authors': {'author': [{'ce:indexed-name': f"{rng.choice(SURNAMES)} {rng.choice('ABCDEFGHJKLMNPRSTW')}."}
+                               for _ in range(max(1, int(rng.expovariate(1 / 4))))]},
+        #Scopus gives a dict for a single affiliation and a list otherwise, parse_paper handles both
+        'affiliation': affiliations[0] if len(affiliations) == 1 else affiliations,
+    }}
+
+def write_corpus(output, papers, seed=42, doi_rate=0.7):
+    #Same layout as SCOPUS_DATA_PATH: one directory per year holding one JSON file per paper
+    rng = random.Random(seed)
+    for year in YEARS:
+        os.makedirs(os.path.join(output, str(year)), exist_ok=True)
+    size = 0
+    for i in range(papers):
+        year = YEARS[i % len(YEARS)]
+        path = os.path.join(output, str(year), f"{year}{i:07d}.json")
+        with open(path, 'w') as file:
+            json.dump(make_paper(rng, year, doi_rate), file)
+        size += os.path.getsize(path)
+    return size
+
+def make_questions(count, seed=42):
+    #Questions mixing topic words, like what users type into Ask Jim
+    rng = random.Random(seed)
+    templates = ["What is known about {} and {}?", "Recent work on {} for {}", "How does {} affect {}?",
+                 "Which studies compare {} with {}?", "{} {} research in Thailand"]
+    questions = []
+    for _ in range(count):
+        words = TOPICS[rng.choice(list(TOPICS))]
+        questions.append(rng.choice(templates).format(*rng.sample(words, 2)))
+    return questions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate Scopus-shaped JSON papers for benchmarking the pipeline")
+    parser.add_argument("output", help="directory to fill with <year>/<file>.json papers")
+    parser.add_argument("--papers", type=int, default=10000)
+    parser.add_argument("--doi-rate", type=float, default=0.7, help="share of papers that come with a DOI")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    size = write_corpus(args.output, args.papers, args.seed, args.doi_rate)
+    print(f"Wrote {args.papers} papers ({size / 1e6:.1f} MB) to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import time
+
+from dotenv import load_dotenv, find_dotenv
+
+from data_extraction import LINK_TABLES
+
+load_dotenv()
+
+#Authors per paper, counted from the junction table so it matches the author charts
+AUTHOR_COUNTS = "(SELECT paper_id, COUNT(*) AS authors FROM paper_author GROUP BY paper_id)"
+
+#Rollups per (year, journal) that eda.py combines for any year range and journal selection
+AGGREGATES = {
+    'agg_year_journal': f'''
+        SELECT p.year, p.publication_name, COUNT(*) AS papers,
+               SUM(COALESCE(CAST(p.citation_count AS INTEGER), 0)) AS citations, SUM(COALESCE(a.authors, 0)) AS authors
+        FROM paper_data p LEFT JOIN {AUTHOR_COUNTS} a ON a.paper_id = p.paper_id
+        GROUP BY p.year, p.publication_name''',
+    'agg_month': '''
+        SELECT year, publication_name, substr(coverdate, 1, 7) AS month, COUNT(*) AS papers
+        FROM paper_data
+        WHERE coverdate IS NOT NULL AND coverdate != ''
+        GROUP BY year, publication_name, month''',
+    'agg_team_size': f'''
+        SELECT p.year, p.publication_name, COALESCE(a.authors, 0) AS authors, COUNT(*) AS papers
+        FROM paper_data p LEFT JOIN {AUTHOR_COUNTS} a ON a.paper_id = p.paper_id
+        GROUP BY p.year, p.publication_name, COALESCE(a.authors, 0)''',
+    #Exact citation values with their paper counts, enough for histograms and quartiles. Older databases hold
+    #Scopus' citedby-count as text, the cast groups '12' with 12 and '' with 0
+    'agg_citations': '''
+        SELECT year, publication_name, COALESCE(CAST(citation_count AS INTEGER), 0) AS citation_count, COUNT(*) AS papers
+        FROM paper_data
+        GROUP BY year, publication_name, COALESCE(CAST(citation_count AS INTEGER), 0)''',
+}
+
+for entity, link, id_col in LINK_TABLES.values():
+    AGGREGATES[f'agg_{entity}'] = f'''
+        SELECT p.year, p.publication_name, l.{id_col} AS entity_id, COUNT(*) AS papers
+        FROM paper_data p JOIN {link} l ON l.paper_id = p.paper_id
+        GROUP BY p.year, p.publication_name, l.{id_col}'''
+    #Without a journal filter the per-year table is summed instead, it has far fewer rows
+    AGGREGATES[f'agg_{entity}_year'] = f'''
+        SELECT p.year, l.{id_col} AS entity_id, COUNT(*) AS papers
+        FROM paper_data p JOIN {link} l ON l.paper_id = p.paper_id
+        GROUP BY p.year, l.{id_col}'''
+
+def index_columns(name):
+    return "year" if name.endswith('_year') else "year, publication_name"
+
+def build_aggregates(con):
+    #Rebuilt in one transaction, the dashboard never sees a half written set of tables
+    cur = con.cursor()
+    sizes = {}
+    cur.execute("BEGIN;")
+    for name, query in AGGREGATES.items():
+        cur.execute(f"DROP TABLE IF EXISTS {name};")
+        cur.execute(f"CREATE TABLE {name} AS {query};")
+        cur.execute(f"CREATE INDEX {name}_idx ON {name}({index_columns(name)});")
+        sizes[name] = cur.execute(f"SELECT COUNT(*) FROM {name};").fetchone()[0]
+    cur.execute("COMMIT;")
+    return sizes
+
+def main():
+    root = find_dotenv()
+
+    db_path = os.getenv("SQLITE_DB_PATH", "")
+    if not db_path:
+        print("Please set SQLITE_DB_PATH in your .env file")
+        return
+
+    db_path = os.path.join(os.path.dirname(root), db_path)
+
+    con = sqlite3.connect(db_path, isolation_level=None)
+    con.execute("PRAGMA journal_mode=WAL;")
+
+    start = time.perf_counter()
+    sizes = build_aggregates(con)
+    con.close()
+    for name, rows in sizes.items():
+        print(f"{name}: {rows} rows")
+    print(f"Built {len(sizes)} aggregate tables in {time.perf_counter() - start:.1f}s")
+
+if __name__ == '__main__':
+    main()
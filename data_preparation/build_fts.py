@@ -0,0 +1,103 @@
+import argparse
+import os
+import sqlite3
+import time
+
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv()
+
+#Columns searched by the lexical half of Ask Jim's hybrid retrieval, author names make name queries match
+FTS_COLUMNS = ['title', 'description', 'author_names']
+
+#External content table: FTS5 keeps only the postings and reads the text back from paper_data
+FTS_SCHEMA = f'''
+CREATE VIRTUAL TABLE paper_fts USING fts5(
+        {', '.join(FTS_COLUMNS)},
+        content='paper_data',
+        content_rowid='paper_id',
+        tokenize='porter unicode61')
+'''
+
+NEW_VALUES = ', '.join(f"new.{column}" for column in FTS_COLUMNS)
+OLD_VALUES = ', '.join(f"old.{column}" for column in FTS_COLUMNS)
+
+#Triggers keep the postings in step with data_extraction.py upserts and deletes
+TRIGGERS = {
+    'paper_fts_insert': f'''
+        CREATE TRIGGER paper_fts_insert AFTER INSERT ON paper_data BEGIN
+            INSERT INTO paper_fts (rowid, {', '.join(FTS_COLUMNS)}) VALUES (new.paper_id, {NEW_VALUES});
+        END''',
+    'paper_fts_delete': f'''
+        CREATE TRIGGER paper_fts_delete AFTER DELETE ON paper_data BEGIN
+            INSERT INTO paper_fts (paper_fts, rowid, {', '.join(FTS_COLUMNS)}) VALUES ('delete', old.paper_id, {OLD_VALUES});
+        END''',
+    'paper_fts_update': f'''
+        CREATE TRIGGER paper_fts_update AFTER UPDATE OF {', '.join(FTS_COLUMNS)} ON paper_data BEGIN
+            INSERT INTO paper_fts (paper_fts, rowid, {', '.join(FTS_COLUMNS)}) VALUES ('delete', old.paper_id, {OLD_VALUES});
+            INSERT INTO paper_fts (rowid, {', '.join(FTS_COLUMNS)}) VALUES (new.paper_id, {NEW_VALUES});
+        END''',
+}
+
+def existing(con, kind):
+    return {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type = ?;", (kind,))}
+
+def build_fts(con, rebuild=False):
+    #Returns True when the postings were rebuilt from paper_data
+    cur = con.cursor()
+    tables = existing(con, 'table')
+    if 'paper_fts' in tables and rebuild:
+        cur.execute("DROP TABLE paper_fts;")
+        tables.discard('paper_fts')
+
+    created = 'paper_fts' not in tables
+    if created:
+        cur.execute(FTS_SCHEMA)
+
+    #Triggers are lost when paper_data is rebuilt by a migration, the index is stale until rebuilt
+    triggers = existing(con, 'trigger')
+    missing = [name for name in TRIGGERS if name not in triggers]
+    for name in missing:
+        cur.execute(TRIGGERS[name])
+
+    if created or missing:
+        #One streaming pass over paper_data inside SQLite
+        cur.execute("INSERT INTO paper_fts (paper_fts) VALUES ('rebuild');")
+    con.commit()
+    return bool(created or missing)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the FTS5 full-text index used for BM25 paper search")
+    parser.add_argument("--rebuild", action="store_true", help="drop and rebuild the index from paper_data")
+    parser.add_argument("--optimize", action="store_true", help="merge index segments for faster queries")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    root = find_dotenv()
+
+    db_path = os.getenv("SQLITE_DB_PATH", "")
+    if not db_path:
+        print("Please set SQLITE_DB_PATH in your .env file")
+        return
+
+    db_path = os.path.join(os.path.dirname(root), db_path)
+
+    con = sqlite3.connect(db_path)
+    con.execute("PRAGMA journal_mode=WAL;")
+
+    start = time.perf_counter()
+    if build_fts(con, args.rebuild):
+        papers = con.execute("SELECT COUNT(*) FROM paper_data;").fetchone()[0]
+        print(f"Indexed {papers} papers in {time.perf_counter() - start:.1f}s")
+    else:
+        print("Full-text index is up to date, kept in sync by triggers on paper_data")
+
+    if args.optimize:
+        con.execute("INSERT INTO paper_fts (paper_fts) VALUES ('optimize');")
+        con.commit()
+        print("Optimized full-text index")
+    con.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,10 @@
+import argparse
+import hashlib
 import json
+import multiprocessing as mp
 import os
 import sqlite3
+import time
 from dotenv import load_dotenv, find_dotenv
 
 load_dotenv()
@@ -9,6 +13,9 @@ def extract_data(data_path):
     with(open(data_path, 'r') as file):
         data = json.load(file)
 
+    return parse_paper(data)
+
+def parse_paper(data):
     paper_data = data['abstracts-retrieval-response']
 
     title = paper_data['coredata'].get('dc:title', '')
@@ -66,6 +73,7 @@ COLUMNS = ['title', 'description', 'year', 'coverdate', 'publication_name', 'cit
 
 SCHEMA = f'''
 CREATE TABLE paper_data (
+        paper_id INTEGER PRIMARY KEY AUTOINCREMENT,
         title VARCHAR(300),
         description VARCHAR(10000),
         year INT,
@@ -80,7 +88,261 @@ CREATE TABLE paper_data (
         doi varchar(30))
 '''
 
+#List fields that are also normalized into an entity table and a paper junction table
+LINK_TABLES = {
+    'subject_areas': ('subject', 'paper_subject', 'subject_id'),
+    'author_names': ('author', 'paper_author', 'author_id'),
+    'affiliations': ('affiliation', 'paper_affiliation', 'affiliation_id'),
+    'countries': ('country', 'paper_country', 'country_id'),
+}
+
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS paper_data_doi_idx ON paper_data(doi);",
+    "CREATE INDEX IF NOT EXISTS paper_data_year_idx ON paper_data(year);",
+    "CREATE INDEX IF NOT EXISTS paper_data_publication_idx ON paper_data(publication_name, year);",
+]
+
+def build_links(paper_info):
+    return tuple(paper_info[field] for field in LINK_TABLES)
+
+def build_row(paper_info, year, file_name, delimiter):
+    return (
+        paper_info['title'],
+        paper_info['description'],
+        year,
+        paper_info['coverdate'],
+        paper_info['publication_name'],
+        str(paper_info['citation_count']),
+        delimiter.join(paper_info['subject_areas']),
+        delimiter.join(paper_info['author_names']),
+        delimiter.join(paper_info['affiliations']),
+        delimiter.join(paper_info['countries']),
+        paper_info['doi'],
+        file_name #For debugging purposes
+    )
+
+MANIFEST_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS ingest_manifest (
+        path VARCHAR(300) PRIMARY KEY,
+        year INT,
+        file_name VARCHAR(50),
+        size INT,
+        mtime_ns INT,
+        content_hash VARCHAR(32),
+        ingested_at REAL)
+'''
+
+UPSERT = (
+    f"INSERT INTO paper_data ({', '.join(COLUMNS)}) VALUES ({', '.join(['?']*len(COLUMNS))}) "
+    f"ON CONFLICT(year, file_name) DO UPDATE SET "
+    + ", ".join(f"{col}=excluded.{col}" for col in COLUMNS if col not in ('year', 'file_name'))
+)
+
+UPSERT_MANIFEST = (
+    "INSERT INTO ingest_manifest (path, year, file_name, size, mtime_ns, content_hash, ingested_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(path) DO UPDATE SET size=excluded.size, mtime_ns=excluded.mtime_ns, "
+    "content_hash=excluded.content_hash, ingested_at=excluded.ingested_at"
+)
+
+def migrate_paper_ids(con):
+    #Tables created before paper_id existed are rebuilt so the old rowid becomes the surrogate key.
+    #AUTOINCREMENT keeps ids of deleted papers from being reused, embeddings and the FAISS index are keyed by them
+    cur = con.cursor()
+    sql = cur.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='paper_data';").fetchone()[0]
+    if 'AUTOINCREMENT' in sql.upper():
+        return
+
+    columns = [row[1] for row in cur.execute("PRAGMA table_info(paper_data);")]
+    source_id = 'paper_id' if 'paper_id' in columns else 'rowid'
+    print("Migrating paper_data to stable integer paper_id keys...")
+    cur.execute("ALTER TABLE paper_data RENAME TO paper_data_legacy;")
+    cur.execute(SCHEMA)
+    cur.execute(f"INSERT INTO paper_data (paper_id, {', '.join(COLUMNS)}) SELECT {source_id}, {', '.join(COLUMNS)} FROM paper_data_legacy;")
+    cur.execute("DROP TABLE paper_data_legacy;")
+
+def init_db(con):
+    #Check if table doesn't exist then create it
+    cur = con.cursor()
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='paper_data';")
+    if not cur.fetchone():
+        cur.execute(SCHEMA)
+    else:
+        migrate_paper_ids(con)
+
+    #Older databases may hold duplicate rows from repeated runs, keep the latest one per file
+    cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND name='paper_data_file_idx';")
+    if not cur.fetchone():
+        cur.execute("DELETE FROM paper_data WHERE rowid NOT IN (SELECT MAX(rowid) FROM paper_data GROUP BY year, file_name);")
+        cur.execute("CREATE UNIQUE INDEX paper_data_file_idx ON paper_data(year, file_name);")
+
+    for statement in INDEXES:
+        cur.execute(statement)
+
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='paper_author';")
+    created_links = not cur.fetchone()
+    for entity, link, id_col in LINK_TABLES.values():
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {entity} ({id_col} INTEGER PRIMARY KEY, name VARCHAR(300) NOT NULL UNIQUE);")
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {link} (paper_id INT NOT NULL, {id_col} INT NOT NULL, PRIMARY KEY (paper_id, {id_col})) WITHOUT ROWID;")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {link}_{id_col}_idx ON {link}({id_col}, paper_id);")
+
+    cur.execute(MANIFEST_SCHEMA)
+    con.commit()
+    return created_links
+
+def lookup_id(cur, entity, id_col, name, name_ids):
+    key = (entity, name)
+    if key not in name_ids:
+        cur.execute(f"INSERT OR IGNORE INTO {entity} (name) VALUES (?);", (name,))
+        name_ids[key] = cur.execute(f"SELECT {id_col} FROM {entity} WHERE name = ?;", (name,)).fetchone()[0]
+    return name_ids[key]
+
+def write_links(cur, paper_id, links, name_ids):
+    for (entity, link, id_col), names in zip(LINK_TABLES.values(), links):
+        cur.execute(f"DELETE FROM {link} WHERE paper_id = ?;", (paper_id,))
+        ids = {lookup_id(cur, entity, id_col, name, name_ids) for name in names if name}
+        cur.executemany(f"INSERT INTO {link} (paper_id, {id_col}) VALUES (?, ?);", [(paper_id, i) for i in ids])
+
+def backfill_links(con, delimiter, name_ids):
+    #Fill the junction tables from the delimiter-joined columns of rows ingested before they existed
+    cur = con.cursor()
+    fields = list(LINK_TABLES)
+    rows = con.execute(f"SELECT paper_id, {', '.join(fields)} FROM paper_data;").fetchall()
+    for row in rows:
+        links = tuple(value.split(delimiter) if value else [] for value in row[1:])
+        write_links(cur, row[0], links, name_ids)
+    con.commit()
+    return len(rows)
+
+def load_manifest(con):
+    manifest = {}
+    for path, size, mtime_ns, content_hash in con.execute("SELECT path, size, mtime_ns, content_hash FROM ingest_manifest;"):
+        manifest[path] = (size, mtime_ns, content_hash)
+    return manifest
+
+def list_files(data_path):
+    for year in sorted(os.listdir(data_path)):
+        year_path = os.path.join(data_path, year)
+        if not os.path.isdir(year_path):
+            continue
+
+        for file_name in sorted(os.listdir(year_path)):
+            yield year, file_name, os.path.join(year_path, file_name)
+
+def plan_files(data_path, manifest, seen, force=False):
+    #Yield only files that are new or whose size/mtime changed since they were last ingested
+    for year, file_name, path in list_files(data_path):
+        key = f"{year}/{file_name}"
+        seen.add(key)
+
+        stat = os.stat(path)
+        known = manifest.get(key)
+        if not force and known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            continue
+
+        old_hash = None if force or not known else known[2]
+        yield (year, file_name, path, key, stat.st_size, stat.st_mtime_ns, old_hash)
+
+def parse_file(task, delimiter):
+    year, file_name, path, key, size, mtime_ns, old_hash = task
+    with open(path, 'rb') as file:
+        raw = file.read()
+
+    content_hash = hashlib.blake2b(raw, digest_size=16).hexdigest()
+    manifest_row = (key, year, file_name, len(raw), mtime_ns, content_hash, time.time())
+
+    #Touched but unchanged files only need their manifest entry refreshed
+    if content_hash == old_hash:
+        return None, manifest_row
+
+    paper_info = parse_paper(json.loads(raw))
+    return (build_row(paper_info, year, file_name, delimiter), build_links(paper_info)), manifest_row
+
+def parse_worker(tasks, results, delimiter):
+    #Each worker parses files until it receives None, then signals it is done
+    while True:
+        task = tasks.get()
+        if task is None:
+            results.put(None)
+            return
+
+        try:
+            row, manifest_row = parse_file(task, delimiter)
+            results.put((row, manifest_row, None))
+        except Exception as e:
+            results.put((None, None, f"{task[2]}: {e}"))
+
+def parse_parallel(files, workers, queue_size, delimiter):
+    #Rows stream back through a bounded queue so workers block when the writer falls behind
+    tasks = mp.Queue()
+    results = mp.Queue(maxsize=queue_size)
+
+    procs = [mp.Process(target=parse_worker, args=(tasks, results, delimiter), daemon=True) for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+
+    for task in files:
+        tasks.put(task)
+    for _ in procs:
+        tasks.put(None)
+
+    running = len(procs)
+    while running:
+        result = results.get()
+        if result is None:
+            running -= 1
+            continue
+        yield result
+
+    for proc in procs:
+        proc.join()
+
+def parse_serial(files, delimiter):
+    for task in files:
+        try:
+            row, manifest_row = parse_file(task, delimiter)
+            yield row, manifest_row, None
+        except Exception as e:
+            yield None, None, f"{task[2]}: {e}"
+
+def write_batch(con, records, manifest_rows, name_ids):
+    #Rows and their manifest entries commit together, so a crash never leaves a file half recorded
+    cur = con.cursor()
+    for row, links in records:
+        paper_id = cur.execute(UPSERT + " RETURNING paper_id;", row).fetchone()[0]
+        write_links(cur, paper_id, links, name_ids)
+    cur.executemany(UPSERT_MANIFEST, manifest_rows)
+    con.commit()
+
+def remove_missing(con, manifest, seen):
+    missing = [key for key in manifest if key not in seen]
+    for key in missing:
+        year, file_name = key.split('/', 1)
+        for _, link, _ in LINK_TABLES.values():
+            con.execute(f"DELETE FROM {link} WHERE paper_id IN (SELECT paper_id FROM paper_data WHERE year = ? AND file_name = ?);", (year, file_name))
+        con.execute("DELETE FROM paper_data WHERE year = ? AND file_name = ?;", (year, file_name))
+        con.execute("DELETE FROM ingest_manifest WHERE path = ?;", (key,))
+    con.commit()
+    return len(missing)
+
+def report(files, size, start, final=False):
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    prefix = "Done:" if final else "Progress:"
+    print(f"{prefix} {files} files, {size / 1e6:.1f} MB in {elapsed:.1f}s "
+          f"({files / elapsed:.1f} files/s, {size / 1e6 / elapsed:.2f} MB/s)", flush=True)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract Scopus JSON files into the paper_data SQLite table")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="number of parser processes, 1 parses in the writer process")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per SQLite commit")
+    parser.add_argument("--queue-size", type=int, default=4096, help="max parsed rows waiting for the writer")
+    parser.add_argument("--report-every", type=int, default=5000, help="print throughput every N files")
+    parser.add_argument("--force", action="store_true", help="re-parse every file even if the manifest says it is unchanged")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     root = find_dotenv()
 
     db_path = os.getenv("SQLITE_DB_PATH", "")
@@ -92,52 +354,61 @@ def main():
     db_path = os.path.join(os.path.dirname(root), db_path)
 
     con = sqlite3.connect(db_path)
+    con.execute("PRAGMA journal_mode=WAL;")
+    con.execute("PRAGMA synchronous=NORMAL;")
+    created_links = init_db(con)
 
-    #Check if table doesn't exist then create it
-    cur = con.cursor()
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='paper_data';")
-    if not cur.fetchone():
-        cur.execute(SCHEMA)
-        con.commit()
-    
     DATA_PATH = os.getenv("SCOPUS_DATA_PATH", "")
     DELIMITER = os.getenv("DATA_DELIMITER", "+")
 
+    name_ids = {}
+    if created_links:
+        print("Backfilled junction tables for", backfill_links(con, DELIMITER, name_ids), "existing papers")
+
     data_path = os.path.join(os.path.dirname(root), DATA_PATH)
 
     print("Starting data extraction... ")
-    count = 0
-    for year in os.listdir(data_path):
-        year_path = os.path.join(data_path, year)
-        if not os.path.isdir(year_path):
+    manifest = load_manifest(con)
+    seen = set()
+    files = plan_files(data_path, manifest, seen, force=args.force)
+    if args.workers > 1:
+        results = parse_parallel(files, args.workers, args.queue_size, DELIMITER)
+    else:
+        results = parse_serial(files, DELIMITER)
+
+    start = time.perf_counter()
+    count, updated, failed, total_size = 0, 0, 0, 0
+    records, manifest_rows = [], []
+    for record, manifest_row, error in results:
+        if error is not None:
+            print("Failed to extract", error)
+            failed += 1
             continue
 
-        data = []
-        for file_name in os.listdir(year_path):
-            extract_data_path = os.path.join(year_path, file_name)
-            paper_info = extract_data(extract_data_path)
-            row = (
-                paper_info['title'],
-                paper_info['description'],
-                year,
-                paper_info['coverdate'],
-                paper_info['publication_name'],
-                str(paper_info['citation_count']),
-                DELIMITER.join(paper_info['subject_areas']),
-                DELIMITER.join(paper_info['author_names']),
-                DELIMITER.join(paper_info['affiliations']),
-                DELIMITER.join(paper_info['countries']),
-                paper_info['doi'],
-                file_name #For debugging purposes
-            )
-            print(f"{file_name}\tExtracted data for paper:", paper_info['title'])
-            count += 1
-
-            data.append(row)
-        cur.executemany(f"INSERT INTO paper_data ({', '.join(COLUMNS)}) VALUES ({', '.join(['?']*len(COLUMNS))})", data)
-        con.commit()
+        if record is not None:
+            records.append(record)
+            updated += 1
+        manifest_rows.append(manifest_row)
+        count += 1
+        total_size += manifest_row[3]
+
+        if len(manifest_rows) >= args.batch_size:
+            write_batch(con, records, manifest_rows, name_ids)
+            records, manifest_rows = [], []
+
+        if count % args.report_every == 0:
+            report(count, total_size, start)
+
+    if manifest_rows:
+        write_batch(con, records, manifest_rows, name_ids)
+
+    #Only prune once the whole tree has been listed, otherwise unvisited files would look deleted
+    removed = remove_missing(con, manifest, seen)
     con.close()
-    print("Data extraction completed. Total papers processed:", count)
+
+    report(count, total_size, start, final=True)
+    print(f"Data extraction completed. Scanned: {len(seen)} Changed: {count} Upserted: {updated} "
+          f"Removed: {removed} Failed: {failed}")
 
 if __name__ == '__main__':
     main()
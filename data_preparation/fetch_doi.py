@@ -1,69 +1,218 @@
+import argparse
+import os
 import sqlite3
-import pandas as pd
-import requests
+import threading
 import time
-import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from dotenv import load_dotenv
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv, find_dotenv
 
 load_dotenv()
 EMAIL = os.getenv("CROSSREF_EMAIL", "")
-DELAY = 1
-CROSSREF_URL = "https://api.crossref.org/works"
+CROSSREF_URL = os.getenv("CROSSREF_URL", "https://api.crossref.org/works")
+MAX_RETRIES = 3
+
+CACHE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS doi_cache (
+        title VARCHAR(300) PRIMARY KEY,
+        doi VARCHAR(100),
+        fetched_at REAL)
+'''
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
 
-def fetch_doi_crossref(title) -> str | None: 
+    def limit(self, rate):
+        #Never go faster than what the server advertises
+        with self.lock:
+            if rate < self.rate:
+                self.rate = rate
+                self.capacity = max(1.0, rate)
+                self.tokens = min(self.tokens, self.capacity)
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+def parse_interval(value):
+    value = value.strip().lower()
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    for unit in sorted(units, key=len, reverse=True):
+        if value.endswith(unit):
+            return float(value[:-len(unit)]) * units[unit]
+    return float(value)
+
+def apply_rate_headers(limiter, headers):
+    #Crossref reports its current limit as X-Rate-Limit-Limit requests per X-Rate-Limit-Interval
+    limit = headers.get("X-Rate-Limit-Limit")
+    interval = headers.get("X-Rate-Limit-Interval")
+    if limit and interval:
+        try:
+            limiter.limit(float(limit) / parse_interval(interval))
+        except ValueError:
+            pass
+
+def make_session(workers):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    if EMAIL:
+        session.headers["User-Agent"] = f"DSProject/1.0 (mailto:{EMAIL})"
+    return session
+
+def fetch_doi_crossref(session, limiter, title, timeout=30):
+    #Returns (resolved, doi), resolved is False when the lookup itself failed and should be retried later
     params = {
         "query.bibliographic": title,
         "rows": 1,
         "select": "DOI,title"
-    } 
+    }
+
+    for attempt in range(MAX_RETRIES):
+        limiter.acquire()
+        try:
+            res = session.get(CROSSREF_URL, params=params, timeout=timeout)
+        except requests.RequestException:
+            time.sleep(2 ** attempt)
+            continue
+
+        apply_rate_headers(limiter, res.headers)
+
+        if res.status_code in (429, 503):
+            retry_after = res.headers.get("Retry-After", "")
+            limiter.pause(float(retry_after) if retry_after.isdigit() else 2 ** attempt)
+            continue
 
-    if EMAIL:
-        headers = {
-                "User-Agent": f"DSProject/1.0 (mailto:{EMAIL})"
-        }
-    else:
-        headers = {}
-
-    try:
-        res = requests.get(CROSSREF_URL, params=params, headers=headers)
         if res.status_code != 200:
-            print("Something went wrong with:", title)
-            return None
+            return False, None
+
+        try:
+            items = res.json().get("message", {}).get("items", [])
+        except ValueError:
+            return False, None
 
-        data = res.json()
-        items = data.get("message", {}).get("items", [])
         if len(items) == 0:
-            print("No paper found with title:", title)
-            return None
-        
-        return items[0].get("DOI")
-    except:
-        print("Something went wrong with:", title)
-        return None
-
-con = sqlite3.connect('../data/extracted/paper_data.db')
-df = pd.read_sql_query("SELECT * FROM paper_data;", con)
-con.close()
-
-missing = df['doi'].isna() | df['doi'].eq('')
-missing_count = missing.sum()
-
-found, progress = 0, 0
-
-print(f"Found {missing_count} missing DOIs")
-for index, row in df[missing].iterrows():
-    title = row['title']
-    doi = fetch_doi_crossref(title)
-
-    progress += 1
-    if doi is not None:
-        df.at[index, 'doi'] = doi
-        found += 1
-        print(f"({progress}/{missing_count}) Found DOI for {title}")
-    else:
-        print(f"({progress}/{missing_count}) Not found DOI for {title}")
-    time.sleep(DELAY)
-
-
-df.to_csv("../data/processed_data/scopus_data_doi.csv")
+            return True, None
+        return True, items[0].get("DOI")
+
+    return False, None
+
+def load_cache(cache_con):
+    cache_con.execute(CACHE_SCHEMA)
+    cache_con.commit()
+    return dict(cache_con.execute("SELECT title, doi FROM doi_cache;"))
+
+def resolve_path(root, path):
+    return os.path.join(os.path.dirname(root), path)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Fill missing DOIs in paper_data using the Crossref API")
+    parser.add_argument("--workers", type=int, default=3, help="concurrent Crossref requests")
+    parser.add_argument("--rate", type=float, default=5.0,
+                        help="max requests per second, lowered automatically if Crossref advertises less")
+    parser.add_argument("--cache", default=os.getenv("DOI_CACHE_PATH", ""),
+                        help="SQLite file caching title lookups, relative to the .env directory (default: next to the database)")
+    parser.add_argument("--retry-misses", action="store_true", help="query titles again that were previously not found")
+    parser.add_argument("--csv", default="../data/processed_data/scopus_data_doi.csv",
+                        help="export paper_data to this CSV when done, empty to skip")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    root = find_dotenv()
+
+    db_path = os.getenv("SQLITE_DB_PATH", "")
+    if not db_path:
+        print("Please set SQLITE_DB_PATH in your .env file")
+        return
+
+    db_path = resolve_path(root, db_path)
+    cache_path = resolve_path(root, args.cache) if args.cache else os.path.join(os.path.dirname(db_path), "doi_cache.db")
+
+    #Each DOI is committed in its own short transaction. The long busy timeout lets those writes wait out a bulk
+    #writer, like build_aggregates.py run alongside by pipeline.py, instead of failing with "database is locked"
+    con = sqlite3.connect(db_path, timeout=600)
+    con.execute("PRAGMA journal_mode=WAL;")
+    cache_con = sqlite3.connect(cache_path)
+    cache = load_cache(cache_con)
+
+    #Papers sharing a title only need one lookup
+    papers = {}
+    for paper_id, title in con.execute("SELECT paper_id, title FROM paper_data WHERE doi IS NULL OR doi = '';"):
+        if title:
+            papers.setdefault(title, []).append(paper_id)
+
+    def save_doi(title, doi):
+        con.executemany("UPDATE paper_data SET doi = ? WHERE paper_id = ?;", [(doi, paper_id) for paper_id in papers[title]])
+        con.commit()
+
+    pending = []
+    for title in papers:
+        if title not in cache or (cache[title] is None and args.retry_misses):
+            pending.append(title)
+        elif cache[title] is not None:
+            save_doi(title, cache[title])
+
+    print(f"Found {len(papers)} titles with missing DOIs, {len(pending)} not in cache")
+
+    found, progress = 0, 0
+    limiter = TokenBucket(args.rate)
+    with make_session(args.workers) as session, ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(fetch_doi_crossref, session, limiter, title): title for title in pending}
+        for future in as_completed(futures):
+            title = futures[future]
+            resolved, doi = future.result()
+            progress += 1
+
+            #Results are written as they arrive so an interrupted run keeps everything resolved so far
+            if resolved:
+                cache_con.execute("INSERT OR REPLACE INTO doi_cache (title, doi, fetched_at) VALUES (?, ?, ?);", (title, doi, time.time()))
+                cache_con.commit()
+
+            if doi is not None:
+                save_doi(title, doi)
+                found += 1
+                print(f"({progress}/{len(pending)}) Found DOI for {title}")
+            elif resolved:
+                print(f"({progress}/{len(pending)}) Not found DOI for {title}")
+            else:
+                print(f"({progress}/{len(pending)}) Something went wrong with: {title}")
+
+    print(f"Resolved {found} of {len(pending)} titles")
+
+    if args.csv:
+        df = pd.read_sql_query("SELECT * FROM paper_data;", con)
+        df.to_csv(args.csv)
+
+    cache_con.close()
+    con.close()
+
+if __name__ == '__main__':
+    main()
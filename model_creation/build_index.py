@@ -0,0 +1,215 @@
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+from embedding_store import EmbeddingStore, EMBEDDINGS_DIR
+
+INDEX_TYPES = ['flat', 'ivf_flat', 'ivf_pq', 'hnsw']
+DEFAULT_INDEX_TYPE = 'flat'
+INDEX_FILE = os.getenv("FAISS_INDEX_PATH", "../models/faiss_scopus_index.idx")
+#Build and search parameters left unset on the command line, update_index.py takes them from the existing index first
+INDEX_DEFAULTS = {'nlist': None, 'nprobe': 16, 'pq_m': 64, 'pq_bits': 8, 'hnsw_m': 32, 'ef_construction': 200, 'ef_search': 64}
+
+def default_nlist(n):
+    #Usual rule of thumb, about 4 * sqrt(n) lists with at least ~39 training points per list
+    return int(max(1, min(4 * np.sqrt(n), n // 39)))
+
+def create_index(kind, dimension, n, args):
+    if kind == 'flat':
+        return faiss.IndexIDMap(faiss.IndexFlatL2(dimension))
+
+    if kind == 'hnsw':
+        hnsw = faiss.IndexHNSWFlat(dimension, args.hnsw_m)
+        hnsw.hnsw.efConstruction = args.ef_construction
+        return faiss.IndexIDMap(hnsw)
+
+    nlist = args.nlist or default_nlist(n)
+    quantizer = faiss.IndexFlatL2(dimension)
+    if kind == 'ivf_flat':
+        return faiss.IndexIVFFlat(quantizer, dimension, nlist)
+    return faiss.IndexIVFPQ(quantizer, dimension, nlist, args.pq_m, args.pq_bits)
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    #nprobe only exists on IVF indexes and efSearch on HNSW ones, other types ignore them
+    params = faiss.ParameterSpace()
+    for name, value in (('nprobe', nprobe), ('efSearch', ef_search)):
+        if not value:
+            continue
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            pass
+
+def index_params(index):
+    #Type and parameters of a built index, as read back from its file
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(base, faiss.IndexHNSW):
+        return 'hnsw', {'hnsw_m': base.hnsw.nb_neighbors(1), 'ef_construction': base.hnsw.efConstruction,
+                        'ef_search': base.hnsw.efSearch}
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is None:
+        return 'flat', {}
+    ivf = faiss.downcast_index(ivf)
+    params = {'nlist': ivf.nlist, 'nprobe': ivf.nprobe}
+    if isinstance(ivf, faiss.IndexIVFPQ):
+        return 'ivf_pq', {**params, 'pq_m': ivf.pq.M, 'pq_bits': ivf.pq.nbits}
+    return 'ivf_flat', params
+
+def resolve_index_args(args, params=None):
+    #Fills the parameters not given on the command line from params, then from INDEX_DEFAULTS
+    for name, default in INDEX_DEFAULTS.items():
+        if getattr(args, name) is None:
+            setattr(args, name, (params or {}).get(name, default))
+    return args
+
+def sample_vectors(store, size, seed):
+    #Uniform sample across all shards, used to train IVF and PQ quantizers
+    rng = np.random.default_rng(seed)
+    total = len(store)
+    fraction = min(1.0, size / max(total, 1))
+    samples = []
+    for _, vectors in store.iter_shards():
+        take = np.sort(rng.choice(len(vectors), int(round(len(vectors) * fraction)), replace=False))
+        samples.append(np.asarray(vectors[take], dtype='float32'))
+    return np.ascontiguousarray(np.concatenate(samples))
+
+def add_vectors(index, store, ids=None, batch_size=50000):
+    #Adds the stored vectors (only those in ids, if given) shard by shard under their paper ids
+    added = 0
+    for shard_ids, vectors in store.iter_shards():
+        if ids is not None:
+            keep = np.isin(shard_ids, ids)
+            shard_ids, vectors = shard_ids[keep], vectors[keep]
+        for start in range(0, len(shard_ids), batch_size):
+            batch = np.ascontiguousarray(vectors[start:start + batch_size], dtype='float32')
+            index.add_with_ids(batch, shard_ids[start:start + batch_size])
+            added += len(batch)
+    return added
+
+def build_index(kind, store, args, ids=None):
+    n = len(store) if ids is None else len(ids)
+    index = create_index(kind, store.manifest["dimension"], n, args)
+
+    if not index.is_trained:
+        index.train(sample_vectors(store, args.train_size, args.seed))
+
+    add_vectors(index, store, ids, args.add_batch)
+    set_search_params(index, args.nprobe, args.ef_search)
+    return index
+
+def time_queries(index, queries, k):
+    latencies, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, result = index.search(query.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found.append(result[0])
+    return found, np.array(latencies)
+
+def evaluate(index, store, args):
+    #Recall@k against an exact flat search over the same vectors, using a sample of the corpus as queries
+    queries = sample_vectors(store, args.eval_queries, args.seed + 1)[:args.eval_queries]
+
+    exact = faiss.IndexIDMap(faiss.IndexFlatL2(store.manifest["dimension"]))
+    add_vectors(exact, store, batch_size=args.add_batch)
+
+    truth, exact_latencies = time_queries(exact, queries, args.k)
+    found, latencies = time_queries(index, queries, args.k)
+    recall = np.mean([len(set(f) & set(t)) / args.k for f, t in zip(found, truth)])
+
+    return {
+        "queries": len(queries),
+        f"recall@{args.k}": float(recall),
+        "latency_ms_p50": float(np.percentile(latencies, 50)),
+        "latency_ms_p95": float(np.percentile(latencies, 95)),
+        "flat_latency_ms_p50": float(np.percentile(exact_latencies, 50)),
+        "flat_latency_ms_p95": float(np.percentile(exact_latencies, 95))
+    }
+
+def add_index_args(parser):
+    parser.add_argument("--type", choices=INDEX_TYPES, help=f"index type (default: {DEFAULT_INDEX_TYPE})")
+    parser.add_argument("--store", default=EMBEDDINGS_DIR, help="embedding shard directory written by embed.py")
+    parser.add_argument("--nlist", type=int, help="IVF lists, defaults to about 4 * sqrt(n)")
+    parser.add_argument("--nprobe", type=int, help="IVF lists scanned per query (default: 16)")
+    parser.add_argument("--pq-m", type=int, help="PQ sub-quantizers, must divide the dimension (default: 64)")
+    parser.add_argument("--pq-bits", type=int, help="bits per PQ code (default: 8)")
+    parser.add_argument("--hnsw-m", type=int, help="HNSW neighbours per node (default: 32)")
+    parser.add_argument("--ef-construction", type=int, help="HNSW build beam width (default: 200)")
+    parser.add_argument("--ef-search", type=int, help="HNSW search beam width (default: 64)")
+    parser.add_argument("--train-size", type=int, default=100000, help="vectors sampled to train IVF/PQ")
+    parser.add_argument("--add-batch", type=int, default=50000)
+    parser.add_argument("--threads", type=int, help="FAISS OpenMP threads")
+    parser.add_argument("--seed", type=int, default=42)
+
+def write_index(index, path, store):
+    #Written next to the target and renamed over it, so readers never see a half-written file
+    tmp_path = path + ".tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+    record_shards(path, store)
+
+def record_shards(path, store):
+    #The sidecar records how many embedding shards the index covers, later shards may re-embed indexed papers
+    tmp_path = path + ".json.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump({"embedding_shards": len(store.manifest["shards"])}, file)
+    os.replace(tmp_path, path + ".json")
+
+def indexed_shards(path):
+    #Embedding shards covered by the index at path, indexes written without a sidecar are taken as current
+    if not os.path.exists(path + ".json"):
+        return None
+    with open(path + ".json") as file:
+        return json.load(file)["embedding_shards"]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build a FAISS index for Ask Jim from the paper embeddings")
+    add_index_args(parser)
+    parser.add_argument("--output", help=f"index file (default: {INDEX_FILE})")
+    parser.add_argument("--per-type", action="store_true",
+                        help="name the output after the index type, e.g. faiss_scopus_index_hnsw.idx, to compare types side by side")
+    parser.add_argument("--eval-queries", type=int, default=500, help="0 skips the recall/latency report")
+    parser.add_argument("--k", type=int, default=10)
+    parser.set_defaults(type=DEFAULT_INDEX_TYPE)
+    return resolve_index_args(parser.parse_args())
+
+def main():
+    args = parse_args()
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    output = args.output or INDEX_FILE
+    if args.per_type:
+        root, extension = os.path.splitext(output)
+        output = f"{root}_{args.type}{extension}"
+
+    #FAISS ids are stable paper ids from the embedding store
+    store = EmbeddingStore(args.store)
+    if len(store) == 0:
+        raise SystemExit(f"No embeddings in {args.store}, run embed.py first")
+
+    print(f"Building {args.type} index over {len(store)} vectors of dimension {store.manifest['dimension']}...")
+    start = time.perf_counter()
+    index = build_index(args.type, store, args)
+    build_seconds = time.perf_counter() - start
+
+    write_index(index, output, store)
+    report = {
+        "type": args.type,
+        "output": output,
+        "vectors": int(index.ntotal),
+        "build_seconds": build_seconds,
+        "index_mb": os.path.getsize(output) / 1e6,
+    }
+
+    if args.eval_queries > 0:
+        report.update(evaluate(index, store, args))
+
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+import argparse
+import os
+
+import pandas as pd
+import pyarrow as pa
+
+import paper_store
+
+#Legacy CSV outputs of the notebooks, only read with --csv
+PROJECTION_FILE = "../data/processed_data/scopus_data_doi_cleaned_with_projections.csv"
+CLUSTER_FILE = "../data/processed_data/scopus_data_cleansed_clusters.csv"
+LABEL_FILE = "../data/processed_data/cluster_clear_labels.csv"
+METADATA_FILE = os.getenv("METADATA_STORE_PATH", "../models/paper_metadata.arrow")
+
+#Columns served to askjim.py, eda.py and clusters.py, the embedding input text is left out
+COLUMNS = ['title', 'doi', 'abstract', 'year', 'coverdate', 'publication_name', 'citation_count',
+           'author_names', 'subject_areas', 'affiliations', 'countries', 'x', 'y', 'cluster']
+
+SCHEMA = {
+    'title': pa.string(), 'doi': pa.string(), 'abstract': pa.large_string(), 'year': pa.float64(),
+    'coverdate': pa.string(), 'publication_name': pa.string(), 'citation_count': pa.float64(),
+    'author_names': pa.string(), 'subject_areas': pa.string(), 'affiliations': pa.string(),
+    'countries': pa.string(), 'x': pa.float64(), 'y': pa.float64(), 'cluster': pa.float64(),
+    'clear_label': pa.string()
+}
+
+def load_labels(path):
+    if not path or not os.path.exists(path):
+        return None
+    return pd.read_csv(path, index_col=0)['clear_label']
+
+def to_batch(chunk, start, labels):
+    #Rows from the paper store carry their paper id, legacy CSV rows use their position like the notebook index
+    chunk = chunk.reset_index(drop=True)
+    if 'paper_id' in chunk:
+        ids = chunk['paper_id']
+    else:
+        ids = range(start, start + len(chunk))
+    data = {'faiss_id': pa.array(ids, type=pa.int64())}
+    for column in COLUMNS:
+        if column not in chunk:
+            continue
+        values = chunk[column]
+        if pa.types.is_floating(SCHEMA[column]):
+            values = pd.to_numeric(values, errors='coerce')
+        data[column] = pa.array(values, type=SCHEMA[column], from_pandas=True)
+    #Labels from label_clusters.py arrive with the rows, the CSV labels are the notebook fallback
+    if 'clear_label' in chunk:
+        data['clear_label'] = pa.array(chunk['clear_label'], type=pa.string(), from_pandas=True)
+    elif labels is not None and 'cluster' in chunk:
+        data['clear_label'] = pa.array(chunk['cluster'].map(labels), type=pa.string(), from_pandas=True)
+    return pa.record_batch(data)
+
+def read_csv_chunks(csv_path, chunksize):
+    text_columns = {column: str for column, kind in SCHEMA.items() if not pa.types.is_floating(kind)}
+    return pd.read_csv(csv_path, chunksize=chunksize, usecols=lambda column: column in COLUMNS, dtype=text_columns)
+
+#Optional tables written by the clustering steps, joined in when they exist
+DB_JOINS = {
+    'paper_projection': (('x', 'y'), "paper_projection.paper_id = p.paper_id"),
+    'paper_cluster': (('cluster',), "paper_cluster.paper_id = p.paper_id"),
+    'cluster_label': (('clear_label',), "cluster_label.cluster = paper_cluster.cluster"),
+}
+
+def read_db_chunks(con, chunksize):
+    tables = {row[0] for row in con.execute("SELECT name FROM sqlite_master WHERE type='table';")}
+    columns, joins = [], []
+    for table, (table_columns, condition) in DB_JOINS.items():
+        if table in tables and (table != 'cluster_label' or 'paper_cluster' in tables):
+            columns.extend(f"{table}.{column}" for column in table_columns)
+            joins.append(f"LEFT JOIN {table} ON {condition}")
+
+    query = f'''
+        SELECT p.paper_id, p.title, p.doi, p.description AS abstract, p.year, p.coverdate, p.publication_name,
+               p.citation_count, p.author_names, p.subject_areas, p.affiliations, p.countries
+               {''.join(', ' + column for column in columns)}
+        FROM paper_data p
+        {' '.join(joins)}
+        ORDER BY p.paper_id
+    '''
+    return pd.read_sql_query(query, con, chunksize=chunksize)
+
+def build_store(chunks, output, labels=None):
+    #Written as an uncompressed Arrow IPC file so readers can memory-map it without decoding
+    tmp_path = output + ".tmp"
+    writer, rows = None, 0
+    for chunk in chunks:
+        batch = to_batch(chunk, rows, labels)
+        if writer is None:
+            writer = pa.ipc.new_file(tmp_path, batch.schema)
+        writer.write_batch(batch)
+        rows += len(chunk)
+
+    if writer is None:
+        raise ValueError("no papers to write")
+    writer.close()
+    os.replace(tmp_path, output)
+    return rows
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Write paper metadata to a memory-mappable Arrow store keyed by FAISS id")
+    parser.add_argument("--csv", nargs='?', const='', default=None,
+                        help="read a legacy processed CSV in row-position id order instead of paper_data, "
+                             "defaults to the clustered CSV when given without a path")
+    parser.add_argument("--labels", default=LABEL_FILE, help="cluster label CSV merged as clear_label")
+    parser.add_argument("--output", default=METADATA_FILE)
+    parser.add_argument("--chunksize", type=int, default=50000)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    labels = load_labels(args.labels)
+
+    if args.csv is None:
+        #Keyed by paper_id, matching the ids used by embed.py and update_index.py
+        source = "paper_data"
+        con = paper_store.connect()
+        rows = build_store(read_db_chunks(con, args.chunksize), args.output, labels)
+        con.close()
+    else:
+        source = args.csv or (CLUSTER_FILE if os.path.exists(CLUSTER_FILE) else PROJECTION_FILE)
+        rows = build_store(read_csv_chunks(source, args.chunksize), args.output, labels)
+
+    print(f"Wrote {rows} papers from {source} to {args.output} ({os.path.getsize(args.output) / 1e6:.1f} MB)")
+
+if __name__ == '__main__':
+    main()
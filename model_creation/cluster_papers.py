@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+import paper_store
+from embedding_store import EmbeddingStore, EMBEDDINGS_DIR
+from update_index import live_ids
+
+SWEEP_FILE = "../models/cluster_sweep.json"
+CENTROIDS_FILE = "../models/cluster_centroids.npy"
+
+CLUSTER_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS paper_cluster (
+        paper_id INTEGER PRIMARY KEY,
+        cluster INT NOT NULL,
+        distance REAL)
+'''
+
+def assign(vectors, centroids, batch_size=65536):
+    #Nearest centroid and squared L2 distance for every vector, in batches to bound memory
+    index = faiss.IndexFlatL2(centroids.shape[1])
+    index.add(centroids)
+    labels = np.empty(len(vectors), dtype='int64')
+    distances = np.empty(len(vectors), dtype='float32')
+    for start in range(0, len(vectors), batch_size):
+        D, I = index.search(vectors[start:start + batch_size], 1)
+        labels[start:start + batch_size] = I[:, 0]
+        distances[start:start + batch_size] = D[:, 0]
+    return labels, distances
+
+def grow_centroids(vectors, centroids, k, rng):
+    #Warm start for a larger k: keep the previous centroids and add the sampled points they fit worst
+    extra = k - len(centroids)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), extra * 20), replace=False)]
+    _, distances = assign(sample, centroids)
+    return np.vstack([centroids, sample[np.argsort(distances)[::-1][:extra]]]).astype('float32')
+
+def fit_faiss(vectors, k, init, args):
+    kmeans = faiss.Kmeans(vectors.shape[1], k, niter=args.iterations, seed=args.seed, max_points_per_centroid=args.points_per_centroid)
+    kmeans.train(vectors, init_centroids=init)
+    #obj holds the objective of each iteration on the training sample, scaled up to the whole corpus
+    trained = min(len(vectors), k * args.points_per_centroid)
+    return kmeans.centroids, float(kmeans.obj[-1]) * len(vectors) / trained
+
+def fit_minibatch(vectors, k, init, args):
+    from sklearn.cluster import MiniBatchKMeans
+
+    kmeans = MiniBatchKMeans(n_clusters=k, init='k-means++' if init is None else init, n_init=1,
+                             batch_size=args.batch_size, max_iter=args.iterations, random_state=args.seed)
+    kmeans.fit(vectors)
+    #inertia_ is computed over the full data at the end of fit, no separate distance pass is needed
+    return kmeans.cluster_centers_.astype('float32'), float(kmeans.inertia_)
+
+FIT = {'faiss': fit_faiss, 'minibatch': fit_minibatch}
+
+def sweep_chain(vectors, ks, args):
+    #Fits increasing k one after another, each warm started from the previous centroids
+    rng = np.random.default_rng(args.seed)
+    results, centroids = [], None
+    for k in ks:
+        start = time.perf_counter()
+        init = None if centroids is None or len(centroids) >= k else grow_centroids(vectors, centroids, k, rng)
+        centroids, inertia = FIT[args.backend](vectors, k, init, args)
+        results.append({"k": int(k), "inertia": inertia, "mean_distortion": inertia / len(vectors),
+                        "seconds": time.perf_counter() - start, "centroids": centroids})
+        print(f"k={k}: inertia {inertia:.1f} in {results[-1]['seconds']:.1f}s", flush=True)
+    return results
+
+def sweep(vectors, ks, args):
+    #The k grid is split into contiguous chains that run in parallel, threads share the vectors without copies
+    chains = [chain for chain in np.array_split(np.array(ks), min(args.jobs, len(ks))) if len(chain)]
+    #FAISS threads split the cores between the chains actually running
+    faiss.omp_set_num_threads(max(1, (os.cpu_count() or 1) // len(chains)))
+    with ThreadPoolExecutor(len(chains)) as pool:
+        results = [result for chain in pool.map(lambda chain: sweep_chain(vectors, chain, args), chains) for result in chain]
+    faiss.omp_set_num_threads(os.cpu_count() or 1)
+    return sorted(results, key=lambda result: result["k"])
+
+def elbow(ks, inertias):
+    #Point of the normalized curve furthest below the line joining its ends
+    if len(ks) < 3:
+        return ks[-1]
+    x = (np.array(ks) - ks[0]) / (ks[-1] - ks[0])
+    y = (np.array(inertias) - inertias[-1]) / max(inertias[0] - inertias[-1], 1e-12)
+    return ks[int(np.argmax((1 - x) - y))]
+
+def write_clusters(con, ids, labels, distances):
+    cur = con.cursor()
+    cur.execute(CLUSTER_SCHEMA)
+    cur.execute("DELETE FROM paper_cluster;")
+    cur.executemany("INSERT INTO paper_cluster (paper_id, cluster, distance) VALUES (?, ?, ?);",
+                    zip(ids.tolist(), labels.tolist(), distances.tolist()))
+    cur.execute("CREATE INDEX IF NOT EXISTS paper_cluster_cluster_idx ON paper_cluster(cluster, distance);")
+    con.commit()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Cluster paper embeddings and write cluster ids to the paper store")
+    parser.add_argument("--store", default=EMBEDDINGS_DIR, help="directory holding the embedding shards")
+    parser.add_argument("--backend", choices=list(FIT), default='faiss')
+    parser.add_argument("--k", type=int, help="number of clusters, skips the sweep")
+    parser.add_argument("--k-min", type=int, default=10)
+    parser.add_argument("--k-max", type=int, default=200)
+    parser.add_argument("--k-step", type=int, default=10)
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="sweep chains fitted in parallel")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=4096, help="minibatch backend only")
+    parser.add_argument("--points-per-centroid", type=int, default=256, help="faiss backend training sample per cluster")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--sweep-output", default=SWEEP_FILE)
+    parser.add_argument("--centroids", default=CENTROIDS_FILE)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    store = EmbeddingStore(args.store)
+    con = paper_store.connect()
+    ids, vectors = store.load(live_ids(con, store))
+    if not len(ids):
+        raise SystemExit(f"No embeddings in {args.store}, run embed.py first")
+    print(f"Clustering {len(ids)} papers ({vectors.shape[1]} dimensions) with {args.backend} k-means")
+
+    start = time.perf_counter()
+    faiss.omp_set_num_threads(os.cpu_count() or 1)
+    if args.k:
+        results = sweep_chain(vectors, [args.k], args)
+        chosen = results[0]
+    else:
+        ks = [k for k in range(args.k_min, args.k_max + 1, args.k_step) if k <= len(ids)]
+        if not ks:
+            raise SystemExit(f"No k between --k-min {args.k_min} and --k-max {args.k_max} fits {len(ids)} papers, "
+                             f"lower --k-min or pass --k")
+        results = sweep(vectors, ks, args)
+        best_k = elbow([result["k"] for result in results], [result["inertia"] for result in results])
+        chosen = next(result for result in results if result["k"] == best_k)
+
+        with open(args.sweep_output, "w") as file:
+            json.dump({"backend": args.backend, "papers": len(ids), "chosen_k": best_k,
+                       "sweep": [{key: value for key, value in result.items() if key != "centroids"} for result in results]},
+                      file, indent=2)
+        print(f"Sweep of {len(ks)} values took {time.perf_counter() - start:.1f}s, elbow at k={best_k}")
+
+    labels, distances = assign(vectors, chosen["centroids"])
+    np.save(args.centroids, chosen["centroids"])
+    write_clusters(con, ids, labels, distances)
+    con.close()
+    print(f"Wrote {chosen['k']} clusters for {len(ids)} papers to paper_cluster in {time.perf_counter() - start:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import hashlib
+import time
+
+import numpy as np
+
+import paper_store
+from embedding_store import EmbeddingStore, EMBEDDINGS_DIR
+
+MODEL_NAME = 'all-mpnet-base-v2'
+
+def paper_text(title, description):
+    return f"{title or ''}. {description or ''}".strip(" .")
+
+def text_hash(text):
+    #Stored with each embedding, a paper whose text changed under the same paper_id is re-embedded
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+def load_model(name, backend, device):
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    if device is None:
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    if backend == 'onnx':
+        #Needs optimum[onnxruntime], exports the model to ONNX on first use
+        return SentenceTransformer(name, device='cpu', backend='onnx')
+
+    model = SentenceTransformer(name, device=device)
+    if backend == 'int8':
+        #Dynamic int8 quantization of the linear layers, CPU only
+        model = model.to('cpu')
+        torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
+
+def encode_chunk(model, texts, batch_size):
+    #Encoding texts of similar length together cuts padding, results are put back in input order
+    order = np.argsort([len(text) for text in texts], kind='stable')
+    vectors = model.encode([texts[i] for i in order], batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    result = np.empty_like(vectors)
+    result[order] = vectors
+    return result
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Embed papers that do not have an embedding yet or whose text changed")
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--store", default=EMBEDDINGS_DIR, help="directory holding the embedding shards")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="papers read from SQLite and written per shard")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--dtype", choices=['float32', 'float16'], default='float32')
+    parser.add_argument("--backend", choices=['torch', 'onnx', 'int8'], default='torch',
+                        help="onnx and int8 are CPU backends for hosts without a GPU")
+    parser.add_argument("--device", help="torch device, defaults to cuda when available")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    store = EmbeddingStore(args.store)
+    store.check_model(args.model, args.dtype, args.backend)
+    done, done_hashes = store.hashes()
+    order = np.argsort(done)
+    done, done_hashes = done[order], done_hashes[order]
+
+    con = paper_store.connect()
+    total = con.execute("SELECT COUNT(*) FROM paper_data;").fetchone()[0]
+    print(f"{len(done)} embeddings stored for {total} papers")
+
+    model = None
+    start = time.perf_counter()
+    encoded = changed = 0
+    pending_ids, pending_texts, pending_hashes = [], [], []
+
+    def flush():
+        nonlocal model, encoded, pending_ids, pending_texts, pending_hashes
+        if model is None:
+            model = load_model(args.model, args.backend, args.device)
+        vectors = encode_chunk(model, pending_texts, args.batch_size).astype(args.dtype)
+        store.append(pending_ids, vectors, args.model, args.backend, pending_hashes)
+        encoded += len(pending_ids)
+        print(f"Embedded {encoded} papers ({encoded / (time.perf_counter() - start):.1f} papers/s)", flush=True)
+        pending_ids, pending_texts, pending_hashes = [], [], []
+
+    #Only papers without an embedding, or whose text no longer matches it, are encoded, one shard per chunk
+    for rows in paper_store.iter_papers(con, ['title', 'description'], args.chunk_size):
+        ids = np.array([row[0] for row in rows], dtype='int64')
+        texts = [paper_text(row[1], row[2]) for row in rows]
+        hashes = np.array([text_hash(text) for text in texts], dtype='int64')
+
+        if len(done):
+            position = np.minimum(np.searchsorted(done, ids), len(done) - 1)
+            stored = done[position] == ids
+            stale = ~stored | (done_hashes[position] != hashes)
+        else:
+            stored = np.zeros(len(ids), dtype=bool)
+            stale = ~stored
+        changed += int(np.count_nonzero(stale & stored))
+        for i in np.flatnonzero(stale):
+            pending_ids.append(ids[i])
+            pending_texts.append(texts[i])
+            pending_hashes.append(hashes[i])
+
+        if len(pending_ids) >= args.chunk_size:
+            flush()
+
+    if pending_ids:
+        flush()
+    con.close()
+
+    if encoded == 0:
+        print("Nothing to embed")
+    else:
+        print(f"Done: embedded {encoded} papers ({changed} with changed text), store holds {len(store)}")
+
+if __name__ == '__main__':
+    main()
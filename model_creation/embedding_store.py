@@ -0,0 +1,113 @@
+import json
+import os
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+EMBEDDINGS_DIR = os.getenv("EMBEDDINGS_DIR", "../models/embeddings")
+
+class EmbeddingStore:
+    #Append-only set of .npy shards, each with matching arrays of paper ids and content hashes
+    def __init__(self, path=EMBEDDINGS_DIR):
+        self.path = path
+        self.manifest_path = os.path.join(path, "manifest.json")
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as file:
+                self.manifest = json.load(file)
+        else:
+            self.manifest = {"model": None, "backend": None, "dimension": None, "dtype": None, "shards": []}
+
+    def __len__(self):
+        return len(self.ids())
+
+    @property
+    def model(self):
+        return self.manifest["model"]
+
+    def check_model(self, model, dtype, backend):
+        #The backend changes the vectors too, int8 and onnx models do not reproduce torch embeddings exactly.
+        #Stores written before the backend was recorded were embedded with torch
+        stored_backend = self.manifest.get("backend") or 'torch'
+        if self.model is not None and (self.model != model or self.manifest["dtype"] != dtype or stored_backend != backend):
+            raise SystemExit(f"{self.path} holds {self.manifest['dtype']} embeddings from {self.model} ({stored_backend} backend), "
+                             f"delete it to re-embed with {model} ({dtype}, {backend} backend)")
+
+    def shard_files(self, shard):
+        return os.path.join(self.path, shard["vectors"]), os.path.join(self.path, shard["ids"])
+
+    def current_rows(self, first=0):
+        #A re-embedded paper is appended to a later shard, only its newest row is current.
+        #Yields (shard, ids, keep) for the shards from first on, keep masking the current rows
+        all_ids = [np.load(self.shard_files(shard)[1]) for shard in self.manifest["shards"]]
+        keeps, seen = [], np.empty(0, dtype='int64')
+        for ids in reversed(all_ids):
+            keeps.append(~np.isin(ids, seen))
+            seen = np.concatenate([seen, ids])
+        keeps.reverse()
+        for shard, ids, keep in zip(self.manifest["shards"][first:], all_ids[first:], keeps[first:]):
+            yield shard, ids, keep
+
+    def iter_shards(self):
+        for shard, ids, keep in self.current_rows():
+            vectors = np.load(self.shard_files(shard)[0], mmap_mode='r')
+            yield (ids, vectors) if keep.all() else (ids[keep], vectors[keep])
+
+    def ids(self):
+        shards = [ids for ids, _ in self.iter_shards()]
+        return np.concatenate(shards) if shards else np.empty(0, dtype='int64')
+
+    def ids_since(self, shard_count):
+        #Current ids written by the shards appended after the first shard_count
+        shards = [ids[keep] for _, ids, keep in self.current_rows(shard_count)]
+        return np.concatenate(shards) if shards else np.empty(0, dtype='int64')
+
+    def hashes(self):
+        #(ids, content hashes) of the current rows, shards written before hashes were stored report 0
+        all_ids, all_hashes = [], []
+        for shard, ids, keep in self.current_rows():
+            if "hashes" in shard:
+                hashes = np.load(os.path.join(self.path, shard["hashes"]))
+            else:
+                hashes = np.zeros(len(ids), dtype='int64')
+            all_ids.append(ids[keep])
+            all_hashes.append(hashes[keep])
+        if not all_ids:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='int64')
+        return np.concatenate(all_ids), np.concatenate(all_hashes)
+
+    def load(self, ids=None, dtype='float32'):
+        #Returns (ids, vectors), optionally restricted to the given paper ids, reading shards through mmap
+        all_ids, all_vectors = [], []
+        for shard_ids, vectors in self.iter_shards():
+            if ids is not None:
+                keep = np.isin(shard_ids, ids)
+                shard_ids, vectors = shard_ids[keep], vectors[keep]
+            all_ids.append(shard_ids)
+            all_vectors.append(np.asarray(vectors, dtype=dtype))
+
+        if not all_ids:
+            return np.empty(0, dtype='int64'), np.empty((0, self.manifest["dimension"] or 0), dtype=dtype)
+        return np.concatenate(all_ids), np.concatenate(all_vectors)
+
+    def append(self, ids, vectors, model, backend, hashes):
+        os.makedirs(self.path, exist_ok=True)
+        dtype = str(vectors.dtype)
+        self.check_model(model, dtype, backend)
+
+        number = len(self.manifest["shards"])
+        shard = {"vectors": f"shard_{number:05d}.npy", "ids": f"shard_{number:05d}.ids.npy",
+                 "hashes": f"shard_{number:05d}.hashes.npy", "rows": int(len(ids))}
+        vectors_file, ids_file = self.shard_files(shard)
+        np.save(vectors_file, vectors)
+        np.save(ids_file, np.asarray(ids, dtype='int64'))
+        np.save(os.path.join(self.path, shard["hashes"]), np.asarray(hashes, dtype='int64'))
+
+        #The manifest is replaced last, a crash before this point leaves only an unreferenced shard
+        self.manifest.update({"model": model, "backend": backend, "dimension": int(vectors.shape[1]), "dtype": dtype})
+        self.manifest["shards"].append(shard)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(self.manifest, file, indent=2)
+        os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,138 @@
+import argparse
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import ollama
+
+import paper_store
+
+LLM_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:3b")
+LABEL_FILE = "../data/processed_data/cluster_clear_labels.csv"
+
+PROMPT = """
+Analyze the following list of document titles and generate a concise,
+3-5 word category label that best describes them try to be general.
+
+Return ONLY the label. NO explanations. NO bullet points.
+
+Titles:
+{titles}
+"""
+
+LABEL_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS cluster_label (
+        cluster INT PRIMARY KEY,
+        clear_label VARCHAR(100),
+        papers INT,
+        member_hash VARCHAR(64))''',
+    #Labels keyed by model and member set, a cluster with the same papers is never sent to the LLM twice
+    '''CREATE TABLE IF NOT EXISTS cluster_label_cache (
+        member_hash VARCHAR(64) PRIMARY KEY,
+        clear_label VARCHAR(100),
+        labelled_at REAL)''',
+]
+
+def member_hash(paper_ids, model):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(model.encode('utf-8'))
+    digest.update(np.sort(np.asarray(paper_ids, dtype='int64')).tobytes())
+    return digest.hexdigest()
+
+def load_clusters(con, titles_per_cluster):
+    #Members of every cluster, and the titles closest to its centroid as the deterministic sample
+    clusters = {}
+    for cluster, paper_id in con.execute("SELECT cluster, paper_id FROM paper_cluster;"):
+        clusters.setdefault(cluster, {'ids': [], 'titles': []})['ids'].append(paper_id)
+
+    query = '''
+        SELECT cluster, title FROM (
+            SELECT c.cluster, p.title, ROW_NUMBER() OVER (PARTITION BY c.cluster ORDER BY c.distance, c.paper_id) AS rank
+            FROM paper_cluster c JOIN paper_data p ON p.paper_id = c.paper_id
+            WHERE p.title IS NOT NULL AND p.title != '')
+        WHERE rank <= ?
+        ORDER BY cluster, rank
+    '''
+    for cluster, title in con.execute(query, (titles_per_cluster,)):
+        clusters[cluster]['titles'].append(title)
+    return clusters
+
+def clean_label(text):
+    #Only the first line, without the punctuation small models like to wrap labels in
+    lines = text.strip().split('\n')
+    return lines[0].strip(" .,-_!@#$%^&*()[]{};:'\"<>?/\\|`~")
+
+def get_cluster_label(client, model, titles):
+    formatted_list = "\n".join([f"- {t}" for t in titles])
+    response = client.chat(model=model, messages=[{'role': 'user', 'content': PROMPT.format(titles=formatted_list)}])
+    return clean_label(response['message']['content'])
+
+def write_labels(con, labels, clusters, hashes):
+    cur = con.cursor()
+    cur.execute("DELETE FROM cluster_label;")
+    cur.executemany("INSERT INTO cluster_label (cluster, clear_label, papers, member_hash) VALUES (?, ?, ?, ?);",
+                    [(cluster, label, len(clusters[cluster]['ids']), hashes[cluster]) for cluster, label in sorted(labels.items())])
+    con.commit()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Label paper clusters with an Ollama model, reusing labels of unchanged clusters")
+    parser.add_argument("--model", default=LLM_MODEL)
+    parser.add_argument("--workers", type=int, default=4, help="clusters labelled concurrently")
+    parser.add_argument("--titles", type=int, default=50, help="titles closest to the centroid sent per cluster")
+    parser.add_argument("--relabel", action="store_true", help="ignore cached labels")
+    parser.add_argument("--csv", nargs='?', const=LABEL_FILE, help="also export labels in the notebook CSV format")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    con = paper_store.connect()
+    if not con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='paper_cluster';").fetchone():
+        raise SystemExit("No paper_cluster table, run cluster_papers.py first")
+    for statement in LABEL_SCHEMA:
+        con.execute(statement)
+
+    clusters = load_clusters(con, args.titles)
+    hashes = {cluster: member_hash(members['ids'], args.model) for cluster, members in clusters.items()}
+    cached = {} if args.relabel else dict(con.execute("SELECT member_hash, clear_label FROM cluster_label_cache;"))
+
+    labels = {cluster: cached[hashes[cluster]] for cluster in clusters if hashes[cluster] in cached}
+    pending = [cluster for cluster in clusters if cluster not in labels]
+    print(f"{len(clusters)} clusters: {len(labels)} unchanged, {len(pending)} to label")
+
+    #Honours OLLAMA_HOST, so a local stub of /api/chat can stand in for the real server
+    client = ollama.Client(host=os.getenv("OLLAMA_HOST") or None)
+    start = time.perf_counter()
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(get_cluster_label, client, args.model, clusters[cluster]['titles']): cluster for cluster in pending}
+        for future in as_completed(futures):
+            cluster = futures[future]
+            try:
+                label = future.result()
+            except Exception as e:
+                print(f"Cluster {cluster}: failed ({e})")
+                failed += 1
+                continue
+            print(f"Cluster {cluster}: {label}")
+            labels[cluster] = label
+            #Written as each label arrives so an interrupted run keeps what it paid for
+            con.execute("INSERT OR REPLACE INTO cluster_label_cache (member_hash, clear_label, labelled_at) VALUES (?, ?, ?);",
+                        (hashes[cluster], label, time.time()))
+            con.commit()
+
+    write_labels(con, labels, clusters, hashes)
+    con.close()
+    if pending:
+        print(f"Labelled {len(pending) - failed} clusters in {time.perf_counter() - start:.1f}s")
+    if failed:
+        print(f"{failed} clusters failed and have no label, rerun to retry them")
+
+    if args.csv:
+        import pandas as pd
+
+        pd.DataFrame.from_dict(labels, orient='index', columns=['clear_label']).sort_index().to_csv(args.csv)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,27 @@
+import os
+import sqlite3
+
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv()
+
+def db_path():
+    root = find_dotenv()
+    path = os.getenv("SQLITE_DB_PATH", "")
+    if not path:
+        raise SystemExit("Please set SQLITE_DB_PATH in your .env file")
+    return os.path.join(os.path.dirname(root), path)
+
+def connect():
+    con = sqlite3.connect(db_path())
+    con.execute("PRAGMA journal_mode=WAL;")
+    return con
+
+def iter_papers(con, columns, chunk_size=10000):
+    #Streams paper_data in paper_id order without loading the whole table
+    cur = con.execute(f"SELECT paper_id, {', '.join(columns)} FROM paper_data ORDER BY paper_id;")
+    while True:
+        rows = cur.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
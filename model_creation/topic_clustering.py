@@ -1,25 +1,145 @@
-import pandas as pd
+import argparse
+import os
+import pickle
+import time
+
+import faiss
 import numpy as np
 
-from sklearn.manifold import TSNE
+import paper_store
+from embedding_store import EmbeddingStore, EMBEDDINGS_DIR
+from update_index import live_ids
+
+MODEL_FILE = "../models/projection_model.pkl"
+
+PROJECTION_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS paper_projection (
+        paper_id INTEGER PRIMARY KEY,
+        x REAL NOT NULL,
+        y REAL NOT NULL)
+'''
+
+def fit_opentsne(vectors, args):
+    #FFT-accelerated t-SNE with PCA initialization, the fitted embedding can place new points later
+    from openTSNE import TSNE
+
+    tsne = TSNE(n_components=2, perplexity=args.perplexity, initialization='pca', negative_gradient_method='fft',
+                n_jobs=args.threads, random_state=args.seed, verbose=True)
+    embedding = tsne.fit(vectors)
+    return np.asarray(embedding), embedding
+
+def fit_umap(vectors, args):
+    import umap
+
+    #A fixed random_state makes UMAP single threaded, --no-reproducible trades a repeatable map for --threads
+    reducer = umap.UMAP(n_components=2, n_neighbors=args.neighbors, n_jobs=args.threads,
+                        random_state=args.seed if args.reproducible else None)
+    return reducer.fit_transform(vectors), reducer
+
+def fit_sklearn(vectors, args):
+    #The original full t-SNE, new papers are placed by neighbour interpolation instead of a transform
+    from sklearn.manifold import TSNE
+
+    tsne = TSNE(n_components=2, perplexity=args.perplexity, init='pca', learning_rate='auto',
+                n_jobs=args.threads, random_state=args.seed)
+    return tsne.fit_transform(vectors), None
+
+FIT = {'opentsne': fit_opentsne, 'umap': fit_umap, 'sklearn': fit_sklearn}
+
+def interpolate(reference_vectors, reference_coords, vectors, neighbors):
+    #Inverse distance weighted mean of the nearest projected papers
+    index = faiss.IndexFlatL2(reference_vectors.shape[1])
+    index.add(reference_vectors)
+    distances, indices = index.search(vectors, neighbors)
+    weights = 1.0 / (np.sqrt(np.maximum(distances, 0)) + 1e-6)
+    return (reference_coords[indices] * weights[..., None]).sum(axis=1) / weights.sum(axis=1, keepdims=True)
+
+def transform(saved, store, con, vectors, args):
+    if saved['model'] is not None and saved['backend'] == 'opentsne':
+        return np.asarray(saved['model'].transform(vectors))
+    if saved['model'] is not None and saved['backend'] == 'umap':
+        return saved['model'].transform(vectors)
+
+    rows = con.execute("SELECT paper_id, x, y FROM paper_projection ORDER BY paper_id;").fetchall()
+    reference_ids = np.array([row[0] for row in rows], dtype='int64')
+    coords = np.array([row[1:] for row in rows], dtype='float64')
+    ids, reference_vectors = store.load(reference_ids)
+    #store.load returns ids in shard order, line the coordinates up with them
+    coords = coords[np.searchsorted(reference_ids, ids)]
+    return interpolate(reference_vectors, coords, vectors, args.neighbors)
+
+def write_projection(con, ids, coords, replace):
+    cur = con.cursor()
+    cur.execute(PROJECTION_SCHEMA)
+    if replace:
+        cur.execute("DELETE FROM paper_projection;")
+    cur.executemany("INSERT OR REPLACE INTO paper_projection (paper_id, x, y) VALUES (?, ?, ?);",
+                    zip(ids.tolist(), coords[:, 0].tolist(), coords[:, 1].tolist()))
+    #Papers removed from paper_data drop off the map
+    cur.execute("DELETE FROM paper_projection WHERE paper_id NOT IN (SELECT paper_id FROM paper_data);")
+    con.commit()
+
+def projected_ids(con):
+    cur = con.cursor()
+    cur.execute(PROJECTION_SCHEMA)
+    return np.array([row[0] for row in cur.execute("SELECT paper_id FROM paper_projection;")], dtype='int64')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Project paper embeddings to 2-D for the cluster map")
+    parser.add_argument("mode", choices=['fit', 'transform'], nargs='?', default='transform',
+                        help="fit builds a new map, transform places papers that are not on the map yet (fits when there is no map)")
+    parser.add_argument("--backend", choices=list(FIT), default='umap',
+                        help="opentsne needs the openTSNE package, sklearn is the original full t-SNE")
+    parser.add_argument("--store", default=EMBEDDINGS_DIR, help="directory holding the embedding shards")
+    parser.add_argument("--model", default=MODEL_FILE, help="fitted projection kept for transform mode")
+    parser.add_argument("--threads", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--perplexity", type=float, default=30.0)
+    parser.add_argument("--neighbors", type=int, default=15, help="UMAP neighbourhood and interpolation neighbours")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reproducible", action=argparse.BooleanOptionalAction, default=True,
+                        help="seed the UMAP fit so reruns give the same map, this runs UMAP on one thread. "
+                             "--no-reproducible fits on --threads, but every fit is a different layout")
+    return parser.parse_args()
 
-DATA_FILE = "../data/processed_data/scopus_data_doi_cleaned.csv"
-PROJECTION_FILE = "../models/scopus_tsne_projections.npy"
-VECTORS_FILE = "../models/scopus_embeddings.npy"
+def main():
+    args = parse_args()
+    faiss.omp_set_num_threads(args.threads)
+    store = EmbeddingStore(args.store)
+    con = paper_store.connect()
+    live = live_ids(con, store)
+    if not len(live):
+        raise SystemExit(f"No embeddings in {args.store}, run embed.py first")
 
-df = pd.read_csv(DATA_FILE)
-vectors = np.load(VECTORS_FILE)
+    mode = args.mode
+    if mode == 'transform' and (not os.path.exists(args.model) or not len(projected_ids(con))):
+        print("No existing map, fitting a new one")
+        mode = 'fit'
 
-tsne = TSNE(
-    n_components=2,
-    init='pca',
-    learning_rate='auto'
-)
+    start = time.perf_counter()
+    if mode == 'fit':
+        ids, vectors = store.load(live)
+        print(f"Fitting {args.backend} projection of {len(ids)} papers on {args.threads} threads...")
+        coords, model = FIT[args.backend](vectors, args)
+        with open(args.model, "wb") as file:
+            pickle.dump({'backend': args.backend, 'model': model}, file)
+        write_projection(con, ids, coords, replace=True)
+    else:
+        new = np.setdiff1d(live, projected_ids(con))
+        if not len(new):
+            #Still drops papers that left paper_data
+            write_projection(con, new, np.empty((0, 2)), replace=False)
+            con.close()
+            print("Every paper is already on the map")
+            return
+        with open(args.model, "rb") as file:
+            saved = pickle.load(file)
+        ids, vectors = store.load(new)
+        print(f"Placing {len(ids)} new papers on the existing {saved['backend']} map...")
+        coords = transform(saved, store, con, vectors, args)
+        write_projection(con, ids, coords, replace=False)
 
-projection = tsne.fit_transform(vectors)
-projection_df = pd.DataFrame(projection, columns=['x', 'y']) #type: ignore
-projection_df.to_csv(PROJECTION_FILE, index=False)
+    con.close()
+    print(f"Projected {len(ids)} papers to paper_projection in {time.perf_counter() - start:.1f}s")
 
-df['x'] = projection[:, 0]
-df['y'] = projection[:, 1]
-df.to_csv("../data/processed_data/scopus_data_doi_cleaned_with_projections.csv", index=False)
+if __name__ == '__main__':
+    main()
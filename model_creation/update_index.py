@@ -0,0 +1,139 @@
+import argparse
+import os
+import time
+
+import faiss
+import numpy as np
+import pyarrow as pa
+
+import paper_store
+from build_index import (DEFAULT_INDEX_TYPE, INDEX_FILE, add_index_args, add_vectors, build_index, index_params, indexed_shards,
+                         record_shards, resolve_index_args, set_search_params, write_index)
+from build_metadata_store import METADATA_FILE
+from embedding_store import EmbeddingStore
+
+def index_ids(index):
+    #Paper ids currently held by an IndexIDMap or IVF index
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.vector_to_array(index.id_map).astype('int64')
+
+    ivf = faiss.extract_index_ivf(index)
+    invlists = ivf.invlists
+    ids = []
+    for list_no in range(ivf.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ids.append(faiss.rev_swig_ptr(invlists.get_ids(list_no), size).copy())
+    return np.concatenate(ids).astype('int64') if ids else np.empty(0, dtype='int64')
+
+def supports_remove(index):
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    return not isinstance(base, faiss.IndexHNSW)
+
+def live_ids(con, store):
+    #Papers that still exist in paper_data and have an embedding
+    papers = np.array([row[0] for row in con.execute("SELECT paper_id FROM paper_data;")], dtype='int64')
+    return np.intersect1d(papers, store.ids())
+
+def metadata_ids(path):
+    if not os.path.exists(path):
+        return None
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).read_all().column('faiss_id').to_numpy().copy()
+
+def check(index, live, metadata_path):
+    in_index = index_ids(index)
+    problems = 0
+
+    duplicates = len(in_index) - len(np.unique(in_index))
+    if duplicates:
+        print(f"Index holds {duplicates} duplicate ids")
+        problems += duplicates
+
+    for name, ids in (("paper store", live), ("metadata store", metadata_ids(metadata_path))):
+        if ids is None:
+            print(f"No {name} to compare against")
+            continue
+        missing = np.setdiff1d(ids, in_index)
+        extra = np.setdiff1d(in_index, ids)
+        print(f"{name}: {len(missing)} ids missing from the index, {len(extra)} index ids not in the {name}")
+        problems += len(missing) + len(extra)
+    return problems
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bring the FAISS index in line with the paper and embedding stores")
+    add_index_args(parser)
+    parser.add_argument("--index", default=INDEX_FILE)
+    parser.add_argument("--metadata", default=METADATA_FILE, help="metadata store to validate against")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="build a new index instead of updating in place, keeping the type and parameters of the current one "
+                             "unless given")
+    parser.add_argument("--check", action="store_true", help="only validate index ids against the paper and metadata stores")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.threads:
+        faiss.omp_set_num_threads(args.threads)
+
+    store = EmbeddingStore(args.store)
+    con = paper_store.connect()
+    live = live_ids(con, store)
+    con.close()
+
+    if args.check:
+        problems = check(faiss.read_index(args.index), live, args.metadata)
+        raise SystemExit(1 if problems else 0)
+
+    #The existing index decides the type and parameters, --type only picks the type of the first one
+    start = time.perf_counter()
+    existing = faiss.read_index(args.index) if os.path.exists(args.index) else None
+    if existing is None:
+        kind, params = args.type or DEFAULT_INDEX_TYPE, {}
+        print(f"No index at {args.index}, building a {kind} index")
+    else:
+        kind, params = index_params(existing)
+        if args.type is not None and args.type != kind:
+            if not args.rebuild:
+                raise SystemExit(f"{args.index} is a {kind} index, pass --rebuild to replace it with {args.type}")
+            kind, params = args.type, {}
+    resolve_index_args(args, params)
+    index = None if args.rebuild else existing
+
+    if index is not None:
+        current = index_ids(index)
+        stale = np.setdiff1d(current, live)
+        new = np.setdiff1d(live, current)
+        #Papers re-embedded after the index was written are swapped for their new vectors
+        shards = indexed_shards(args.index)
+        changed = np.intersect1d(store.ids_since(shards), np.intersect1d(current, live)) if shards is not None else np.empty(0, dtype='int64')
+        print(f"Index holds {len(current)} papers: {len(new)} to add, {len(stale)} to remove, {len(changed)} re-embedded")
+
+        remove = np.union1d(stale, changed)
+        if len(remove) and not supports_remove(index):
+            print("HNSW indexes cannot remove vectors, rebuilding with the same parameters")
+            index = None
+        else:
+            if len(remove):
+                index.remove_ids(faiss.IDSelectorBatch(len(remove), faiss.swig_ptr(remove)))
+            add = np.union1d(new, changed)
+            if len(add):
+                add_vectors(index, store, add, args.add_batch)
+            set_search_params(index, args.nprobe, args.ef_search)
+
+            if not len(remove) and not len(add):
+                print("Index is up to date")
+                if shards is None:
+                    record_shards(args.index, store)
+                return
+
+    if index is None:
+        print(f"Building {kind} index over {len(live)} papers...")
+        index = build_index(kind, store, args, ids=live)
+
+    #The retrieval server picks up the replaced file on its next reload check
+    write_index(index, args.index, store)
+    print(f"Wrote {index.ntotal} vectors to {args.index} in {time.perf_counter() - start:.1f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+import argparse
+import hashlib
+import os
+import shlex
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv()
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+#Offline build in dependency order. Each stage is a script run from its own directory, reading and writing
+#the resources named in inputs and outputs. Stages writing the paper database in long transactions run one at
+#a time. doi commits each lookup on its own and waits on SQLite's busy timeout instead, so its network-bound
+#run does not hold the others back
+STAGES = {
+    'ingest': {'dir': 'data_preparation', 'command': ['data_extraction.py'],
+               'inputs': ('corpus',), 'outputs': ('papers',), 'writes_db': True},
+    'doi': {'dir': 'data_preparation', 'command': ['fetch_doi.py', '--csv', ''],
+            'inputs': ('papers',), 'outputs': ('dois',), 'writes_db': False},
+    'fts': {'dir': 'data_preparation', 'command': ['build_fts.py'],
+            'inputs': ('papers',), 'outputs': ('fts',), 'writes_db': True},
+    'aggregates': {'dir': 'data_preparation', 'command': ['build_aggregates.py'],
+                   'inputs': ('papers',), 'outputs': ('aggregates',), 'writes_db': True},
+    'embed': {'dir': 'model_creation', 'command': ['embed.py'],
+              'inputs': ('papers',), 'outputs': ('embeddings',), 'writes_db': False},
+    'index': {'dir': 'model_creation', 'command': ['update_index.py'],
+              'inputs': ('papers', 'embeddings'), 'outputs': ('index',), 'writes_db': False},
+    'cluster': {'dir': 'model_creation', 'command': ['cluster_papers.py'],
+                'inputs': ('papers', 'embeddings'), 'outputs': ('clusters',), 'writes_db': True},
+    'project': {'dir': 'model_creation', 'command': ['topic_clustering.py'],
+                'inputs': ('papers', 'embeddings'), 'outputs': ('projection',), 'writes_db': True},
+    'label': {'dir': 'model_creation', 'command': ['label_clusters.py'],
+              'inputs': ('papers', 'clusters'), 'outputs': ('labels',), 'writes_db': True},
+    'metadata': {'dir': 'model_creation', 'command': ['build_metadata_store.py', '--output', '{metadata}'],
+                 'inputs': ('papers', 'dois', 'projection', 'clusters', 'labels'), 'outputs': ('metadata',), 'writes_db': False},
+}
+
+STATE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS pipeline_state (
+        stage VARCHAR(50) PRIMARY KEY,
+        input_hash VARCHAR(64),
+        output_hash VARCHAR(64),
+        seconds REAL,
+        finished_at REAL)
+'''
+
+def resolve(directory, path):
+    #Paths in .env are relative to the .env file, script defaults are relative to the script's directory
+    return os.path.normpath(os.path.join(directory, path))
+
+def settings():
+    env_dir = os.path.dirname(find_dotenv()) or ROOT
+    db_path = os.getenv("SQLITE_DB_PATH", "")
+    if not db_path:
+        raise SystemExit("Please set SQLITE_DB_PATH in your .env file")
+    model_dir = os.path.join(ROOT, 'model_creation')
+    return {
+        'db': resolve(env_dir, db_path),
+        'corpus': resolve(env_dir, os.getenv("SCOPUS_DATA_PATH", "")),
+        'embeddings': resolve(model_dir, os.getenv("EMBEDDINGS_DIR", "../models/embeddings")),
+        'index': resolve(model_dir, os.getenv("FAISS_INDEX_PATH", "../models/faiss_scopus_index.idx")),
+        'metadata': resolve(model_dir, os.getenv("METADATA_STORE_PATH", "../models/paper_metadata.arrow")),
+    }
+
+def digest(*parts):
+    hasher = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        hasher.update(repr(part).encode('utf-8'))
+    return hasher.hexdigest()
+
+def file_fingerprint(path):
+    #Size and mtime, the same change test data_extraction.py uses for its manifest
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+def tree_fingerprint(path):
+    if not os.path.isdir(path):
+        return None
+    hasher = hashlib.blake2b(digest_size=16)
+    for directory, subdirs, files in os.walk(path):
+        subdirs.sort()
+        for name in sorted(files):
+            full = os.path.join(directory, name)
+            hasher.update(f"{os.path.relpath(full, path)}\0{file_fingerprint(full)}\n".encode('utf-8'))
+    return hasher.hexdigest()
+
+def query_fingerprint(con, query):
+    #Streams the rows through the hash, a missing table fingerprints as None
+    hasher = hashlib.blake2b(digest_size=16)
+    try:
+        cur = con.execute(query)
+        while True:
+            rows = cur.fetchmany(50000)
+            if not rows:
+                break
+            hasher.update(repr(rows).encode('utf-8'))
+    except sqlite3.OperationalError:
+        return None
+    return hasher.hexdigest()
+
+#Cheap fingerprints of each resource. Paper text only changes through ingest, so the manifest of file
+#content hashes stands in for a scan of every abstract
+RESOURCES = {
+    'corpus': lambda con, paths: tree_fingerprint(paths['corpus']),
+    'papers': lambda con, paths: (query_fingerprint(con, "SELECT path, content_hash FROM ingest_manifest ORDER BY path;"),
+                                  query_fingerprint(con, "SELECT COUNT(*), MAX(paper_id) FROM paper_data;")),
+    'dois': lambda con, paths: query_fingerprint(con, "SELECT paper_id, doi FROM paper_data WHERE doi IS NOT NULL AND doi != '' ORDER BY paper_id;"),
+    'fts': lambda con, paths: query_fingerprint(con, "SELECT name, sql FROM sqlite_master WHERE name LIKE 'paper_fts%' ORDER BY name;"),
+    'aggregates': lambda con, paths: query_fingerprint(con, "SELECT name, sql FROM sqlite_master WHERE name LIKE 'agg_%' ORDER BY name;"),
+    'embeddings': lambda con, paths: file_fingerprint(os.path.join(paths['embeddings'], 'manifest.json')),
+    'index': lambda con, paths: file_fingerprint(paths['index']),
+    'clusters': lambda con, paths: query_fingerprint(con, "SELECT paper_id, cluster FROM paper_cluster ORDER BY paper_id;"),
+    'projection': lambda con, paths: query_fingerprint(con, "SELECT paper_id, x, y FROM paper_projection ORDER BY paper_id;"),
+    'labels': lambda con, paths: query_fingerprint(con, "SELECT cluster, clear_label FROM cluster_label ORDER BY cluster;"),
+    'metadata': lambda con, paths: file_fingerprint(paths['metadata']),
+}
+
+def connect(paths):
+    con = sqlite3.connect(paths['db'], timeout=60)
+    con.execute("PRAGMA journal_mode=WAL;")
+    con.execute(STATE_SCHEMA)
+    con.commit()
+    return con
+
+def stage_command(name, paths, extra_args):
+    stage = STAGES[name]
+    return [part.format(**paths) for part in stage['command']] + extra_args.get(name, [])
+
+def input_hash(con, name, paths, extra_args):
+    #The script's own source and arguments count as inputs, editing a stage reruns it
+    stage = STAGES[name]
+    with open(os.path.join(ROOT, stage['dir'], stage['command'][0]), 'rb') as file:
+        source = hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+    return digest(source, stage_command(name, paths, extra_args), [RESOURCES[resource](con, paths) for resource in stage['inputs']])
+
+def output_hash(con, name, paths):
+    return digest([RESOURCES[resource](con, paths) for resource in STAGES[name]['outputs']])
+
+def stage_status(con, name, paths, inputs):
+    row = con.execute("SELECT input_hash, output_hash FROM pipeline_state WHERE stage = ?;", (name,)).fetchone()
+    if row is None:
+        return "never run"
+    if row[0] != inputs:
+        return "inputs changed"
+    if row[1] != output_hash(con, name, paths):
+        return "outputs changed"
+    return "up to date"
+
+def dependencies(selected):
+    #A stage waits for the selected stages producing its inputs, unselected producers are taken as they are
+    producers = {resource: name for name in selected for resource in STAGES[name]['outputs']}
+    return {name: {producers[resource] for resource in STAGES[name]['inputs'] if producers.get(resource, name) != name}
+            for name in selected}
+
+def run_stage(name, paths, extra_args, force, db_lock, print_lock):
+    stage = STAGES[name]
+    con = connect(paths)
+    try:
+        inputs = input_hash(con, name, paths, extra_args)
+        if not force and stage_status(con, name, paths, inputs) == "up to date":
+            return "skipped", 0.0, 0.0
+
+        queued = time.perf_counter()
+        with db_lock if stage['writes_db'] else nullcontext():
+            #Time spent waiting for another database writer is reported apart from the stage's own run time
+            start = time.perf_counter()
+            waited = start - queued
+            process = subprocess.Popen([sys.executable] + stage_command(name, paths, extra_args),
+                                       cwd=os.path.join(ROOT, stage['dir']), stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, text=True, env=dict(os.environ, PYTHONUNBUFFERED="1"))
+            #Parallel stages share the terminal, every line is prefixed with its stage
+            for line in process.stdout:
+                with print_lock:
+                    print(f"[{name}] {line}", end="", flush=True)
+            returncode = process.wait()
+            seconds = time.perf_counter() - start
+        if returncode != 0:
+            return f"failed ({returncode})", seconds, waited
+
+        #The input hash from before the run is stored, inputs changed while it ran are picked up next time
+        con.execute("INSERT OR REPLACE INTO pipeline_state (stage, input_hash, output_hash, seconds, finished_at) VALUES (?, ?, ?, ?, ?);",
+                    (name, inputs, output_hash(con, name, paths), seconds, time.time()))
+        con.commit()
+        return "ran", seconds, waited
+    finally:
+        con.close()
+
+def run_pipeline(selected, paths, extra_args, force, jobs):
+    depends = dependencies(selected)
+    pending, results, running = [name for name in STAGES if name in selected], {}, {}
+    db_lock, print_lock = threading.Lock(), threading.Lock()
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while pending or running:
+            for name in list(pending):
+                blocked = [dep for dep in depends[name] if dep in results and results[dep][0] not in ("ran", "skipped")]
+                if blocked:
+                    pending.remove(name)
+                    results[name] = (f"blocked by {blocked[0]}", 0.0, 0.0)
+                elif all(dep in results for dep in depends[name]):
+                    pending.remove(name)
+                    running[pool.submit(run_stage, name, paths, extra_args, force, db_lock, print_lock)] = name
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                results[name] = outcome, seconds, waited = future.result()
+                with print_lock:
+                    print(f"[{name}] {outcome} in {seconds:.1f}s" + (f" after waiting {waited:.1f}s for the database" if waited >= 0.1 else ""))
+    return results
+
+def parse_stage_args(values):
+    extra = {}
+    for value in values:
+        name, _, args = value.partition('=')
+        if name not in STAGES:
+            raise SystemExit(f"Unknown stage {name}, expected one of {', '.join(STAGES)}")
+        extra[name] = shlex.split(args)
+    return extra
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the offline build, skipping stages whose inputs have not changed")
+    parser.add_argument("stages", nargs='*', metavar="stage", help=f"stages to run, default all: {', '.join(STAGES)}")
+    parser.add_argument("--force", action="store_true", help="run the selected stages even if they are up to date")
+    parser.add_argument("--jobs", type=int, default=2, help="independent stages run at the same time")
+    parser.add_argument("--status", action="store_true", help="only show which stages are up to date")
+    parser.add_argument("--args", action="append", default=[], metavar="STAGE=ARGS",
+                        help="extra arguments for one stage, e.g. --args \"embed=--batch-size 128\"")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    paths = settings()
+    extra_args = parse_stage_args(args.args)
+    unknown = [name for name in args.stages if name not in STAGES]
+    if unknown:
+        raise SystemExit(f"Unknown stage {unknown[0]}, expected one of {', '.join(STAGES)}")
+    selected = set(args.stages or STAGES)
+
+    if args.status:
+        #Stages after a stale one are checked again once it has run, their status depends on its new outputs
+        con, depends, stale = connect(paths), dependencies(selected), set()
+        for name in STAGES:
+            if name not in selected:
+                continue
+            waiting = sorted(depends[name] & stale)
+            status = f"after {', '.join(waiting)}" if waiting else stage_status(con, name, paths, input_hash(con, name, paths, extra_args))
+            if status != "up to date":
+                stale.add(name)
+            print(f"{name:>10}: {status}")
+        con.close()
+        return
+
+    #Scripts write their side outputs (sweep, centroids, projection model) to ../models by default
+    for directory in (os.path.join(ROOT, 'models'), paths['embeddings'], os.path.dirname(paths['index']),
+                      os.path.dirname(paths['metadata'])):
+        os.makedirs(directory, exist_ok=True)
+
+    start = time.perf_counter()
+    results = run_pipeline(selected, paths, extra_args, args.force, args.jobs)
+    ran = [name for name, (outcome, _, _) in results.items() if outcome == "ran"]
+    failed = [name for name, (outcome, _, _) in results.items() if outcome not in ("ran", "skipped")]
+    print(f"Pipeline finished in {time.perf_counter() - start:.1f}s: {len(ran)} ran, "
+          f"{len(results) - len(ran) - len(failed)} up to date, {len(failed)} failed or blocked")
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
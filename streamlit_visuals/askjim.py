@@ -1,39 +1,35 @@
 import streamlit as st
-import pandas as pd
-from sentence_transformers import SentenceTransformer
+import requests
 
-import ollama
+import metrics
+import paper_queries
+import retrieval_client
+from llm import AnswerStream, LLM_MODEL
+from metrics import registry, Trace
+from query_cache import LRUCache, CACHE_FILE, answer_key
 
-import faiss
+@st.cache_resource
+def start_metrics_server():
+    #One /metrics endpoint per Streamlit process, its counters cover every session
+    return metrics.serve(metrics.METRICS_PORT) if metrics.METRICS_PORT else None
 
-@st.cache_data
-def load_index():
-    return faiss.read_index("../models/faiss_scopus_index.idx")
+@st.cache_resource
+def load_answer_cache():
+    #Shared by every session of this Streamlit process and persisted across restarts
+    return LRUCache("answer_cache", path=CACHE_FILE)
 
-@st.cache_data
-def load_data():
-    df = pd.read_csv("../data/processed_data/scopus_data_doi_cleaned_with_projections.csv")
-    return df
+@st.cache_resource
+def load_connection():
+    return paper_queries.connect()
 
 @st.cache_data
-def load_model():
-    model = SentenceTransformer('all-mpnet-base-v2')
-    return model
-
-def ask_ollama(sources, question):
-    prompt = "You are Jim, an AI research assistant. Use the following sources to answer the question.\n\n"
-    for i, source in enumerate(sources):
-        prompt += f"Source {i+1}:\nTitle: {source['title']}\nAbstract: {source['abstract']}\n\n"
-    prompt += f"Question: {question}\n\nAnswer the question based on the above sources. If the information is not available, respond with 'Information not available in the provided sources.'"
-
-    response = ollama.chat(model="llama3.2:3b", messages=[{"role": "user", "content": prompt}])
-    return response['message']['content']
-
-model = load_model()
-index = load_index()
-df = load_data()
+def load_filter_options():
+    con = load_connection()
+    return (paper_queries.year_range(con), paper_queries.journal_names(con),
+            paper_queries.entity_names(con, 'subject'), paper_queries.entity_names(con, 'country'))
 
 st.set_page_config(page_title="AskJim: The All-knowing", layout="wide")
+start_metrics_server()
 st.title("AskJim: The All-knowing")
 
 st.markdown(
@@ -48,32 +44,112 @@ st.markdown(
 user_query = st.text_input("Enter your research question or topic:", "")
 ask = st.button("Ask Jim")
 
-
+#Filters are applied inside the retrieval server, so Jim still gets a full set of sources
+st.sidebar.title("Filters")
+(min_year, max_year), all_journals, all_subjects, all_countries = load_filter_options()
+filters = {}
+if min_year is not None and min_year < max_year:
+    selected_years = st.sidebar.slider("Select Year Range", int(min_year), int(max_year), (int(min_year), int(max_year)))
+    if selected_years != (min_year, max_year):
+        filters['years'] = selected_years
+for field, label, options in (('journals', "Journal", all_journals), ('subjects', "Subject Area", all_subjects),
+                              ('countries', "Country", all_countries)):
+    selected = st.sidebar.multiselect(f"Filter by {label} (Optional)", options)
+    if selected:
+        filters[field] = selected
+
+st.sidebar.markdown("---")
+#The server over-fetches and reranks with a cross-encoder, so fewer, better sources keep the prompt short
+rerank = st.sidebar.checkbox("Rerank sources", value=True)
+k = st.sidebar.slider("Sources given to Jim", 1, 10, 3 if rerank else 5)
 
 if ask and user_query:
-    with st.spinner("Jim is thinking..."):
-        query_vector = model.encode([user_query]).astype('float32')
-        k = 5  # number of nearest neighbors
-        distances, indices = index.search(query_vector, k)
-
-        sources = []
-
-        for rank, idx in enumerate(indices[0]):
-            paper = df.iloc[idx]
-            sources.append({
-                "title": paper['title'],
-                "DOI": paper['doi'],
-                "abstract": paper['abstract']
-            })
-
-        answer = ask_ollama(sources, user_query)
-        st.subheader("Jim's Answer:")
-        st.markdown(answer)
-
-        st.subheader("Sources")
-        for i, source in enumerate(sources):
-            st.markdown(f"**Source {i+1}: {source['title']}**")
-            st.markdown(f"- https://doi.org/{source['DOI']}")
-
-            st.markdown(f"- Abstract: {source['abstract']}")
-            st.markdown("---")
+    trace = Trace("question", k=k, rerank=rerank, filtered=bool(filters))
+    with st.spinner("Jim is searching..."):
+        try:
+            with trace.span("retrieve"):
+                response = retrieval_client.search_details(user_query, k, filters=filters, rerank=rerank, trace_id=trace.trace_id)
+            sources = response["results"]
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 503:
+                registry.inc("failed_questions_total", reason="busy")
+                st.warning("Jim is busy answering other questions, please ask again in a moment.")
+            else:
+                registry.inc("failed_questions_total", reason="server_error")
+                st.error(f"Jim's retrieval server returned an error: {e}")
+            st.stop()
+        except requests.RequestException:
+            registry.inc("failed_questions_total", reason="unreachable")
+            st.error("Jim can't reach the retrieval server. Start it with `python retrieval_server.py` in the streamlit_visuals directory.")
+            st.stop()
+    registry.inc("questions_total")
+    registry.inc("retrieved_results_total", len(sources))
+
+    if not sources:
+        st.warning("No papers match the selected filters.")
+        st.stop()
+
+    st.subheader("Jim's Answer:")
+    answer_box = st.container()
+    stages = ", ".join(f"{stage[:-3]} {ms:.0f}ms" for stage, ms in response["timings"].items())
+    st.caption(f"Retrieved {len(sources)} of {response['candidates']} candidates "
+               f"({response['mode']}{', reranked' if response['reranked'] else ''}) in {response['took_ms']:.0f}ms: {stages}")
+
+    #Sources are rendered before generation starts so there is something to read while Jim answers
+    st.subheader("Sources")
+    for i, source in enumerate(sources):
+        st.markdown(f"**Source {i+1}: {source['title']}**")
+        st.markdown(f"- https://doi.org/{source['DOI']}")
+
+        st.markdown(f"- Abstract: {source['abstract']}")
+        st.markdown("---")
+
+    answer_cache = load_answer_cache()
+    key = answer_key(user_query, [source['id'] for source in sources], LLM_MODEL)
+    answer = answer_cache.get(key)
+
+    llm_info = {}
+    with answer_box:
+        if answer is not None:
+            registry.inc("cache_hits_total", cache="answer")
+            st.markdown(answer)
+            st.caption("Answered from cache")
+        else:
+            registry.inc("cache_misses_total", cache="answer")
+            with trace.span("prompt"):
+                stream = AnswerStream(sources, user_query)
+            with trace.span("llm"):
+                answer = st.write_stream(stream)
+            answer_cache.put(key, stream.text)
+            #Token counts are the ones Ollama reports with its final chunk
+            registry.inc("llm_prompt_tokens_total", stream.prompt_tokens or 0)
+            registry.inc("llm_completion_tokens_total", stream.completion_tokens or 0)
+            if stream.first_token_s is not None:
+                registry.observe("llm_first_token_seconds", stream.first_token_s)
+            llm_info = {"first_token_ms": (stream.first_token_s or 0) * 1000, "prompt_tokens": stream.prompt_tokens,
+                        "completion_tokens": stream.completion_tokens}
+            info = stream.prompt_info
+            st.caption(f"First token after {stream.first_token_s or 0:.2f}s, full answer in {stream.total_s:.2f}s. "
+                       f"Prompt: {stream.prompt_tokens or info['estimated_tokens']} tokens "
+                       f"(estimated {info['estimated_tokens']} of {info['budget']}), {info['sources_used']} sources used, "
+                       f"completion: {stream.completion_tokens} tokens")
+            if info['over_budget']:
+                st.warning("Your question is long, so Jim only saw a shortened abstract of the top source. "
+                           "Ask a shorter question to give Jim more sources.")
+
+    st.session_state["last_trace"] = trace.finish(
+        sources=len(sources), candidates=response["candidates"], mode=response["mode"], reranked=response["reranked"],
+        server_ms=response["took_ms"], server_timings=response["timings"], answer_cached=not llm_info, **llm_info)
+
+#Where the time went for this session's last question, client spans next to the server's own stages
+last_trace = st.session_state.get("last_trace")
+if last_trace:
+    with st.sidebar.expander("Debug: last question"):
+        st.caption(f"Trace {last_trace['trace_id']}, {last_trace['total_ms']:.0f}ms in total")
+        stages = [{"stage": span["stage"], "start (ms)": round(span["start_ms"]), "duration (ms)": round(span["ms"], 1)}
+                  for span in last_trace["spans"]]
+        stages += [{"stage": f"server {stage[:-3]}", "start (ms)": None, "duration (ms)": round(ms, 1)}
+                   for stage, ms in last_trace["server_timings"].items()]
+        st.dataframe(stages, hide_index=True, use_container_width=True)
+        st.json({field: last_trace.get(field) for field in ("k", "sources", "candidates", "mode", "reranked", "answer_cached",
+                                                             "first_token_ms", "prompt_tokens", "completion_tokens")})
@@ -0,0 +1,85 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+class QueueFull(Exception):
+    pass
+
+class BatchTimeout(QueueFull):
+    #A batch that never completes is reported to the caller like a full queue, as an overload to retry
+    pass
+
+class MicroBatcher:
+    #Merges requests from many threads into one handler call, after max_wait_ms or max_batch items, whichever comes first
+    def __init__(self, name, handler, max_batch=16, max_wait_ms=10, max_queue=256):
+        self.name = name
+        self.handler = handler
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.largest = 0
+        threading.Thread(target=self.run, name=f"{name}-batcher", daemon=True).start()
+
+    def submit(self, item):
+        future = Future()
+        try:
+            self.queue.put_nowait((item, future))
+        except queue.Full:
+            #Backpressure: callers fail fast instead of queueing behind work they will time out on
+            self.rejected += 1
+            raise QueueFull(f"{self.name} queue is full")
+        return future
+
+    def __call__(self, item, timeout=None):
+        future = self.submit(item)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            #Still queued items are dropped by run(), a batch already in the handler finishes unobserved
+            future.cancel()
+            self.timed_out += 1
+            raise BatchTimeout(f"{self.name} batch did not finish within {timeout}s")
+
+    def collect(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            #Callers that gave up while queued have cancelled their futures, the rest can no longer be cancelled
+            batch = [(item, future) for item, future in self.collect() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            try:
+                results = self.handler(items)
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name} handler returned {len(results)} results for {len(batch)} items")
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+            self.batches += 1
+            self.items += len(batch)
+            self.largest = max(self.largest, len(batch))
+
+    def stats(self):
+        return {"batches": self.batches, "items": self.items, "mean_batch": self.items / self.batches if self.batches else 0.0,
+                "largest_batch": self.largest, "queued": self.queue.qsize(), "rejected": self.rejected, "timed_out": self.timed_out}
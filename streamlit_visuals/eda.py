@@ -1,44 +1,75 @@
 import streamlit as st
-import pandas as pd
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
 from wordcloud import WordCloud
 import matplotlib.pyplot as plt
 
+import paper_queries
+from scatter_tiles import render_cluster_map
+
 st.set_page_config(page_title="Advanced Scopus Data EDA", layout="wide", page_icon="📊")
 
+#Charts that need individual papers show the most cited ones only
+SCATTER_PAPERS = 5000
+TABLE_PAPERS = 1000
+
+@st.cache_resource
+def load_connection():
+    return paper_queries.connect()
+
+#Every chart reads the small per-(year, journal) rollups from data_preparation/build_aggregates.py,
+#cached on the filter state so moving the slider back is free
 @st.cache_data
-def load_data():
-    df = pd.read_csv('../data/processed_data/scopus_data_doi_cleaned.csv')
-    
-    df['year'] = pd.to_numeric(df['year'], errors='coerce')
-    df['citation_count'] = pd.to_numeric(df['citation_count'], errors='coerce').fillna(0)
-    df['date'] = pd.to_datetime(df['coverdate'], errors='coerce')
-    df['author_count'] = df['author_names'].fillna('').apply(lambda x: len(x.split('+')) if x else 0)
-    
-    return df
+def load_rollup(name, years, journals):
+    return getattr(paper_queries, name)(load_connection(), years, journals)
+
+@st.cache_data
+def load_top(kind, years, journals, limit=10):
+    return paper_queries.top_entities(load_connection(), kind, years, journals, limit)
+
+@st.cache_data
+def load_yearly(kind, names, years, journals):
+    return paper_queries.entity_counts_by_year(load_connection(), kind, names, years, journals)
+
+@st.cache_data
+def load_journal_citations(years, journals, names):
+    return paper_queries.journal_citation_counts(load_connection(), years, journals, names)
+
+@st.cache_data
+def load_papers(years, journals, limit):
+    return paper_queries.papers(load_connection(), years, journals, limit)
 
-try:
-    df = load_data()
-except FileNotFoundError:
-    st.error("File 'scopus_data_doi_cleaned.csv' not found. Please ensure it is in the same directory.")
+@st.cache_data(max_entries=2)
+def load_papers_csv(years, journals):
+    return paper_queries.papers_csv(load_connection(), years, journals)
+
+@st.cache_data
+def load_journal_names(years):
+    return paper_queries.aggregate_journal_names(load_connection(), years)
+
+def weighted_quantiles(values, weights, quantiles):
+    order = np.argsort(values)
+    cumulative = np.cumsum(weights[order]) / weights.sum()
+    return [values[order][min(np.searchsorted(cumulative, q), len(values) - 1)] for q in quantiles]
+
+if not paper_queries.has_aggregates(load_connection()):
+    st.error("Dashboard aggregates not found. Build them with `python build_aggregates.py` in the data_preparation directory.")
     st.stop()
 
 st.sidebar.title("Filters")
 
-min_year = int(df['year'].min())
-max_year = int(df['year'].max())
+min_year, max_year = (int(year) for year in paper_queries.aggregate_year_range(load_connection()))
 selected_years = st.sidebar.slider("Select Year Range", min_year, max_year, (min_year, max_year))
 
-df_filtered = df[(df['year'] >= selected_years[0]) & (df['year'] <= selected_years[1])]
-
-all_journals = sorted(df_filtered['publication_name'].dropna().unique())
+all_journals = load_journal_names(selected_years)
 selected_journals = st.sidebar.multiselect("Filter by Journal (Optional)", all_journals)
-if selected_journals:
-    df_filtered = df_filtered[df_filtered['publication_name'].isin(selected_journals)]
+
+journal_filter = tuple(selected_journals)
+totals = load_rollup('overview', selected_years, journal_filter)
 
 st.sidebar.markdown("---")
-st.sidebar.info(f"Showing **{len(df_filtered)}** papers")
+st.sidebar.info(f"Showing **{totals['papers']}** papers")
 
 st.title("📊 Advanced Scopus Bibliometric Analysis")
 
@@ -55,11 +86,12 @@ with tab1:
     st.header("General Overview")
     
     # KPIs
+    papers = max(totals['papers'], 1)
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
-    kpi1.metric("Total Publications", f"{len(df_filtered):,}")
-    kpi2.metric("Total Citations", f"{int(df_filtered['citation_count'].sum()):,}")
-    kpi3.metric("Avg Citations/Paper", f"{df_filtered['citation_count'].mean():.2f}")
-    kpi4.metric("Avg Authors/Paper", f"{df_filtered['author_count'].mean():.2f}")
+    kpi1.metric("Total Publications", f"{totals['papers']:,}")
+    kpi2.metric("Total Citations", f"{totals['citations']:,}")
+    kpi3.metric("Avg Citations/Paper", f"{totals['citations'] / papers:.2f}")
+    kpi4.metric("Avg Authors/Paper", f"{totals['authors'] / papers:.2f}")
     
     st.markdown("---")
     
@@ -68,16 +100,15 @@ with tab1:
     
     with col1:
         st.subheader("Annual Publication Trend")
-        pub_year = df_filtered.groupby('year').size().reset_index(name='Count')
+        pub_year = load_rollup('yearly_counts', selected_years, journal_filter)
         fig_year = px.area(pub_year, x='year', y='Count', markers=True, 
                            title="Number of Publications per Year")
         st.plotly_chart(fig_year, use_container_width=True)
         
     with col2:
         st.subheader("Monthly Publication Trend")
-        if df_filtered['date'].notna().any():
-            # Group by Month-Year
-            pub_month = df_filtered.set_index('date').resample('M').size().reset_index(name='Count')
+        pub_month = load_rollup('monthly_counts', selected_years, journal_filter)
+        if len(pub_month):
             fig_month = px.line(pub_month, x='date', y='Count', title="Monthly Publishing Volume")
             st.plotly_chart(fig_month, use_container_width=True)
         else:
@@ -90,8 +121,7 @@ with tab2:
     
     with col_a1:
         st.subheader("Top 10 Most Productive Authors")
-        authors = df_filtered['author_names'].dropna().str.split('+').explode()
-        top_authors = authors.value_counts().head(10).reset_index()
+        top_authors = load_top('author', selected_years, journal_filter)
         top_authors.columns = ['Author', 'Publications']
         fig_auth = px.bar(top_authors, x='Publications', y='Author', orientation='h', 
                           color='Publications', color_continuous_scale='Viridis')
@@ -100,8 +130,7 @@ with tab2:
 
     with col_a2:
         st.subheader("Top 10 Affiliated Countries")
-        countries = df_filtered['countries'].dropna().str.split('+').explode()
-        top_countries = countries.value_counts().head(10).reset_index()
+        top_countries = load_top('country', selected_years, journal_filter)
         top_countries.columns = ['Country', 'Publications']
         fig_country = px.bar(top_countries, x='Publications', y='Country', orientation='h',
                              color='Publications', color_continuous_scale='Plasma')
@@ -112,8 +141,7 @@ with tab2:
     
     with col_a3:
         st.subheader("Top 10 Affiliations")
-        affils = df_filtered['affiliations'].dropna().str.split('+').explode()
-        top_affils = affils.value_counts().head(10).reset_index()
+        top_affils = load_top('affiliation', selected_years, journal_filter)
         top_affils.columns = ['Affiliation', 'Publications']
         fig_affil = px.bar(top_affils, x='Publications', y='Affiliation', orientation='h',
                            color='Publications', color_continuous_scale='Magma')
@@ -122,7 +150,8 @@ with tab2:
         
     with col_a4:
         st.subheader("Authors per Paper Distribution")
-        fig_auth_hist = px.histogram(df_filtered, x='author_count', nbins=20, 
+        team_sizes = load_rollup('team_sizes', selected_years, journal_filter)
+        fig_auth_hist = px.histogram(team_sizes, x='author_count', y='papers', histfunc='sum', nbins=20, 
                                      title="Distribution of Team Sizes")
         fig_auth_hist.update_layout(xaxis_title="Number of Authors", yaxis_title="Number of Papers")
         st.plotly_chart(fig_auth_hist, use_container_width=True)
@@ -133,10 +162,11 @@ with tab3:
     col_j1, col_j2 = st.columns(2)
     
     top_k = st.slider("Select Top Journals to Display", min_value=5, max_value=20, value=10)
+    journals = load_rollup('journal_totals', selected_years, journal_filter)
 
     with col_j1:
         st.subheader("Top Journals by Volume")
-        top_journals = df_filtered['publication_name'].value_counts().head(top_k).reset_index()
+        top_journals = journals.nlargest(top_k, 'papers')[['publication_name', 'papers']]
         top_journals.columns = ['Journal', 'Publications']
         fig_j_vol = px.bar(top_journals, x='Publications', y='Journal', orientation='h')
         fig_j_vol.update_layout(yaxis={'categoryorder':'total ascending'})
@@ -144,7 +174,7 @@ with tab3:
         
     with col_j2:
         st.subheader("Top Journals by Total Citations")
-        journal_cit = df_filtered.groupby('publication_name')['citation_count'].sum().sort_values(ascending=False).head(top_k).reset_index()
+        journal_cit = journals.nlargest(top_k, 'citations')[['publication_name', 'citations']]
         journal_cit.columns = ['Journal', 'Total Citations']
         fig_j_cit = px.bar(journal_cit, x='Total Citations', y='Journal', orientation='h', color='Total Citations')
         fig_j_cit.update_layout(yaxis={'categoryorder':'total ascending'})
@@ -154,23 +184,20 @@ with tab3:
     
     st.subheader("Evolution of Top Subject Areas")
     
-    df_subjects = df_filtered[['year', 'subject_areas']].dropna()
-    df_subjects['subject'] = df_subjects['subject_areas'].str.split('+')
-    df_exploded = df_subjects.explode('subject')
-    
-    top_5_subjects = df_exploded['subject'].value_counts().head(5).index.tolist()
+    subject_totals = load_top('subject', selected_years, journal_filter, limit=200)
+    top_5_subjects = tuple(subject_totals['name'].head(5))
     
-    df_evolution = df_exploded[df_exploded['subject'].isin(top_5_subjects)]
-    df_evolution_grouped = df_evolution.groupby(['year', 'subject']).size().reset_index(name='Count')
+    df_evolution_grouped = load_yearly('subject', top_5_subjects, selected_years, journal_filter)
+    df_evolution_grouped.columns = ['year', 'subject', 'Count']
     
     fig_evol = px.line(df_evolution_grouped, x='year', y='Count', color='subject', 
                        markers=True, title="Growth of Top 5 Subject Areas")
     st.plotly_chart(fig_evol, use_container_width=True)
     
     st.subheader("Subject Area Word Cloud")
-    text = " ".join(df_exploded['subject'].dropna())
-    if text:
-        wordcloud = WordCloud(width=1200, height=400, background_color='white').generate(text)
+    frequencies = dict(zip(subject_totals['name'], subject_totals['papers']))
+    if frequencies:
+        wordcloud = WordCloud(width=1200, height=400, background_color='white').generate_from_frequencies(frequencies)
         fig_wc, ax = plt.subplots(figsize=(12, 4))
         ax.imshow(wordcloud, interpolation='bilinear')
         ax.axis("off")
@@ -183,66 +210,55 @@ with tab4:
     
     with col_c1:
         st.subheader("Citations vs. Year (Impact over time)")
-        fig_scatter = px.scatter(df_filtered, x='year', y='citation_count', 
+        top_cited = load_papers(selected_years, journal_filter, SCATTER_PAPERS)
+        fig_scatter = px.scatter(top_cited, x='year', y='citation_count', 
                                  size='citation_count', hover_data=['title', 'publication_name'],
-                                 color='citation_count', title="Papers: Year vs. Citations")
+                                 color='citation_count', title=f"Papers: Year vs. Citations ({len(top_cited):,} most cited)")
         st.plotly_chart(fig_scatter, use_container_width=True)
         
     with col_c2:
         st.subheader("Citation Distribution")
-        fig_hist_cit = px.histogram(df_filtered, x='citation_count', nbins=50, log_y=True,
+        citations = load_rollup('citation_counts', selected_years, journal_filter)
+        fig_hist_cit = px.histogram(citations, x='citation_count', y='papers', histfunc='sum', nbins=50, log_y=True,
                                     title="Log Distribution of Citations")
+        fig_hist_cit.update_layout(yaxis_title="Number of Papers")
         st.plotly_chart(fig_hist_cit, use_container_width=True)
         
     st.subheader("Citation Variance in Top Journals")
-    top_10_journals_list = df_filtered['publication_name'].value_counts().head(10).index
-    df_top_journals = df_filtered[df_filtered['publication_name'].isin(top_10_journals_list)]
-    
-    fig_box = px.box(df_top_journals, x='publication_name', y='citation_count', 
-                     title="Citation Distribution by Top Journals")
-    fig_box.update_layout(xaxis_title="Journal", yaxis_title="Citations")
+    top_10_journals_list = tuple(journals.nlargest(10, 'papers')['publication_name'].dropna())
+    journal_citations = load_journal_citations(selected_years, journal_filter, top_10_journals_list)
+
+    #Box statistics come from the citation counts per journal, no paper rows are loaded
+    fig_box = go.Figure()
+    for journal in top_10_journals_list:
+        counts = journal_citations[journal_citations['publication_name'] == journal]
+        if not len(counts):
+            continue
+        q1, median, q3 = weighted_quantiles(counts['citation_count'].to_numpy(), counts['papers'].to_numpy(), (0.25, 0.5, 0.75))
+        fig_box.add_trace(go.Box(name=journal, q1=[q1], median=[median], q3=[q3],
+                                 lowerfence=[counts['citation_count'].min()], upperfence=[counts['citation_count'].max()]))
+    fig_box.update_layout(title="Citation Distribution by Top Journals", xaxis_title="Journal", yaxis_title="Citations",
+                          showlegend=False)
     st.plotly_chart(fig_box, use_container_width=True)
 
 with tab5:
     st.header("Raw Data")
     st.write("Filter and download the processed data.")
     
+    df_filtered = load_papers(selected_years, journal_filter, TABLE_PAPERS)
+    st.caption(f"Showing the {len(df_filtered):,} most cited of {totals['papers']:,} papers")
     st.dataframe(df_filtered)
     
-    csv = df_filtered.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="📥 Download Filtered CSV",
-        data=csv,
-        file_name='scopus_data_filtered.csv',
-        mime='text/csv',
-    )
-
-@st.cache_data
-def load_scattterd_projection() -> pd.DataFrame:
-    cluster_label = pd.read_csv("../data/processed_data/cluster_clear_labels.csv", index_col=0)
-    scopus = pd.read_csv('../data/processed_data/scopus_data_cleansed_clusters.csv')
-    
-    scopus = scopus.merge(cluster_label, left_on='cluster', right_index=True, how='left')
-    return scopus
+    #The download holds every filtered paper, not just the table above, so it is only built on request
+    if st.button(f"Prepare CSV of all {totals['papers']:,} filtered papers"):
+        st.download_button(
+            label="📥 Download Filtered CSV",
+            data=load_papers_csv(selected_years, journal_filter),
+            file_name='scopus_data_filtered.csv',
+            mime='text/csv',
+            on_click='ignore',
+        )
 
 with tab6:
-    cluster = load_scattterd_projection()
-
-    fig = px.scatter(
-        cluster, 
-        x='x', 
-        y='y',
-        hover_name='title', # Show title on hover
-        hover_data={'x': False, 'y': False, 'doi': True, 'clear_label': True},
-        title="Semantic Clusters of Research Papers with Labels",
-        color='clear_label',
-        opacity=0.5
-    )
-
-    fig.update_layout(
-        xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
-        yaxis=dict(showgrid=False, zeroline=False, showticklabels=False)
-    )
-
     st.title("Topic Clusters of Research Papers")
-    st.plotly_chart(fig, use_container_width=True)
+    render_cluster_map("eda_clusters")
@@ -0,0 +1,72 @@
+import os
+import re
+import sqlite3
+import threading
+
+from dotenv import load_dotenv
+
+from paper_queries import connect, search_filter
+
+load_dotenv()
+
+#bm25 weights for title, abstract and author names, built by data_preparation/build_fts.py
+BM25_WEIGHTS = (10.0, 1.0, 5.0)
+#Constant from the reciprocal rank fusion paper, damps the influence of the very top ranks
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+def match_query(text):
+    #Every word is quoted so user input never reaches FTS5 as query syntax, any word may match
+    words = dict.fromkeys(re.findall(r"\w+", text.lower()))
+    return " OR ".join(f'"{word}"' for word in words)
+
+class LexicalIndex:
+    def __init__(self):
+        #sqlite3 connections are not shared between server threads
+        self.local = threading.local()
+        self.available = self.check()
+
+    def connection(self):
+        if not hasattr(self.local, 'con'):
+            self.local.con = connect()
+        return self.local.con
+
+    def check(self):
+        try:
+            row = self.connection().execute("SELECT name FROM sqlite_master WHERE type='table' AND name='paper_fts';").fetchone()
+        except sqlite3.Error:
+            return False
+        return row is not None
+
+    def search(self, query, k, years=None, journals=None, subjects=None, countries=None):
+        #Returns (paper_id, bm25 score) pairs, best first. FTS5 scores are negative, lower is better
+        match = match_query(query)
+        if not match or not self.available:
+            return []
+
+        where, params = search_filter(years, journals, subjects, countries)
+        if where:
+            sql = f'''
+                SELECT f.rowid, bm25(paper_fts, {', '.join(map(str, BM25_WEIGHTS))}) AS score
+                FROM paper_fts f
+                JOIN paper_data p ON p.paper_id = f.rowid
+                WHERE paper_fts MATCH ? AND {where}
+                ORDER BY score
+                LIMIT ?
+            '''
+        else:
+            sql = f'''
+                SELECT rowid, bm25(paper_fts, {', '.join(map(str, BM25_WEIGHTS))}) AS score
+                FROM paper_fts
+                WHERE paper_fts MATCH ?
+                ORDER BY score
+                LIMIT ?
+            '''
+        return self.connection().execute(sql, [match] + params + [k]).fetchall()
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    #rankings are lists of ids, best first. Returns (id, score) pairs sorted by fused score
+    scores = {}
+    for ranking in rankings:
+        for rank, paper_id in enumerate(ranking):
+            scores[paper_id] = scores.get(paper_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,46 @@
+import os
+import time
+
+import ollama
+from dotenv import load_dotenv
+
+from prompt_builder import build_prompt, PROMPT_TOKEN_BUDGET
+
+load_dotenv()
+
+LLM_MODEL = os.getenv("OLLAMA_MODEL", "llama3.2:3b")
+
+#Honours OLLAMA_HOST, so a local mock of the chat endpoint can stand in for the real server
+client = ollama.Client(host=os.getenv("OLLAMA_HOST") or None)
+
+def ask_ollama(sources, question, budget=PROMPT_TOKEN_BUDGET):
+    prompt, _, _ = build_prompt(sources, question, budget)
+    response = client.chat(model=LLM_MODEL, messages=[{"role": "user", "content": prompt}])
+    return response['message']['content']
+
+class AnswerStream:
+    def __init__(self, sources, question, model=LLM_MODEL, budget=PROMPT_TOKEN_BUDGET):
+        self.prompt, self.sources, self.prompt_info = build_prompt(sources, question, budget)
+        self.model = model
+        self.text = ""
+        self.first_token_s = None
+        self.total_s = None
+        self.prompt_tokens = None
+        self.completion_tokens = None
+
+    def __iter__(self):
+        #Yields answer text as Ollama produces it and records time to first token separately from the total
+        start = time.perf_counter()
+        messages = [{"role": "user", "content": self.prompt}]
+        for chunk in client.chat(model=self.model, messages=messages, stream=True):
+            content = chunk['message']['content']
+            if content:
+                if self.first_token_s is None:
+                    self.first_token_s = time.perf_counter() - start
+                self.text += content
+                yield content
+
+            if chunk.get('done'):
+                self.prompt_tokens = chunk.get('prompt_eval_count')
+                self.completion_tokens = chunk.get('eval_count')
+        self.total_s = time.perf_counter() - start
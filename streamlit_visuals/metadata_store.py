@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pyarrow as pa
+from dotenv import load_dotenv
+
+load_dotenv()
+
+METADATA_FILE = os.getenv("METADATA_STORE_PATH", "../models/paper_metadata.arrow")
+
+class MetadataStore:
+    def __init__(self, path=METADATA_FILE):
+        #Memory-mapped and zero-copy, pages are only read when rows or columns are touched
+        self.source = pa.memory_map(path, 'r')
+        self.table = pa.ipc.open_file(self.source).read_all()
+
+        ids = self.table.column('faiss_id').to_numpy()
+        if len(ids) > 1 and not np.all(ids[1:] > ids[:-1]):
+            self.order = np.argsort(ids, kind='stable')
+            self.sorted_ids = ids[self.order]
+        else:
+            self.order = None
+            self.sorted_ids = ids
+
+    def __len__(self):
+        return self.table.num_rows
+
+    @property
+    def columns(self):
+        return self.table.column_names
+
+    def positions(self, ids):
+        #Row position of each FAISS id, -1 for ids that are not in the store
+        ids = np.asarray(ids, dtype='int64')
+        if not len(self.sorted_ids):
+            return np.full(ids.shape, -1, dtype='int64')
+        found = np.searchsorted(self.sorted_ids, ids)
+        found = np.minimum(found, len(self.sorted_ids) - 1)
+        valid = self.sorted_ids[found] == ids
+        rows = found if self.order is None else self.order[found]
+        return np.where(valid, rows, -1)
+
+    def hydrate(self, ids, columns=('title', 'doi', 'abstract')):
+        positions = self.positions(ids)
+        valid = positions[positions >= 0]
+        rows = iter(self.table.select(list(columns)).take(pa.array(valid)).to_pylist())
+        return [next(rows) if position >= 0 else None for position in positions]
+
+    def take(self, positions, columns):
+        #Selected rows by position, only those pages of the file are read
+        columns = [column for column in columns if column in self.table.column_names]
+        return self.table.select(columns).take(pa.array(positions, type=pa.int64())).to_pandas()
+
+    def to_pandas(self, columns):
+        columns = [column for column in columns if column in self.table.column_names]
+        return self.table.select(columns).to_pandas()
@@ -0,0 +1,144 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+#Append one JSON line per traced request here, empty disables the trace log
+TRACE_LOG = os.getenv("TRACE_LOG", "")
+#Port serving /metrics from the Streamlit process, 0 disables it (the retrieval server always serves its own)
+METRICS_PORT = int(os.getenv("ASKJIM_METRICS_PORT", "0"))
+#Latency buckets in seconds, from a cache hit up to a slow LLM answer
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+class Metrics:
+    #Counters and latency histograms rendered in the Prometheus text format, no client library needed
+    def __init__(self, prefix="askjim"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.setdefault(key, [0] * len(BUCKETS) + [0.0, 0])
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+            histogram[-2] += seconds
+            histogram[-1] += 1
+
+    def collect(self, collector):
+        #collector() returns (name, kind, labels, value) samples read at scrape time, e.g. cache stats
+        self.collectors.append(collector)
+
+    def render(self):
+        #Samples are grouped per metric family, the text format does not allow a family to be split
+        families = {}
+
+        def add(name, kind, line):
+            families.setdefault(name, (kind, []))[1].append(line)
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, list(values)) for key, values in self.histograms.items())
+        for (name, labels), value in counters:
+            add(name, "counter", f"{self.prefix}_{name}{label_text(labels)} {value}")
+        for (name, labels), values in histograms:
+            full = f"{self.prefix}_{name}"
+            for bound, count in zip(BUCKETS, values):
+                add(name, "histogram", f"{full}_bucket{label_text(labels + (('le', bound),))} {count}")
+            add(name, "histogram", f"{full}_bucket{label_text(labels + (('le', '+Inf'),))} {values[-1]}")
+            add(name, "histogram", f"{full}_sum{label_text(labels)} {values[-2]}")
+            add(name, "histogram", f"{full}_count{label_text(labels)} {values[-1]}")
+        for collector in self.collectors:
+            for name, kind, labels, value in collector():
+                add(name, kind, f"{self.prefix}_{name}{label_text(tuple(sorted(labels.items())))} {value}")
+
+        lines = []
+        for name, (kind, samples) in families.items():
+            lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+#One registry per process, shared by every request thread
+registry = Metrics()
+trace_lock = threading.Lock()
+
+class Trace:
+    #Timed spans of one request, observed into the registry and written to TRACE_LOG when it finishes
+    def __init__(self, name, trace_id=None, **attributes):
+        self.name = name
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.attributes = attributes
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.cursor = 0.0
+        self.spans = []
+
+    def add(self, stage, seconds, start=None):
+        #Spans given without a start follow on from the previous one
+        start = self.cursor if start is None else start
+        self.spans.append({"stage": stage, "start_ms": start * 1000, "ms": seconds * 1000})
+        self.cursor = start + seconds
+        registry.observe("stage_seconds", seconds, stage=stage)
+
+    @contextmanager
+    def span(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start, start - self.origin)
+
+    def finish(self, **attributes):
+        total = time.perf_counter() - self.origin
+        registry.observe("request_seconds", total, request=self.name)
+        record = {"trace_id": self.trace_id, "name": self.name, "time": self.started, "total_ms": total * 1000,
+                  "spans": self.spans, **self.attributes, **attributes}
+        if TRACE_LOG:
+            with trace_lock, open(TRACE_LOG, "a") as file:
+                file.write(json.dumps(record) + "\n")
+        return record
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port, host="127.0.0.1"):
+    #For processes without an HTTP server of their own, like Streamlit
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,196 @@
+import io
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv, find_dotenv
+
+load_dotenv()
+
+#entity table, junction table and key column for each normalized list field
+ENTITIES = {
+    'author': ('author', 'paper_author', 'author_id'),
+    'subject': ('subject', 'paper_subject', 'subject_id'),
+    'affiliation': ('affiliation', 'paper_affiliation', 'affiliation_id'),
+    'country': ('country', 'paper_country', 'country_id'),
+}
+
+def connect():
+    root = find_dotenv()
+    db_path = os.path.join(os.path.dirname(root), os.getenv("SQLITE_DB_PATH", ""))
+
+    #Read-only and shared across Streamlit sessions
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+    con.execute("PRAGMA query_only=ON;")
+    return con
+
+def paper_filter(years, journals, alias='p'):
+    clauses = [f"{alias}.year BETWEEN ? AND ?"]
+    params = [int(years[0]), int(years[1])]
+    if journals:
+        clauses.append(f"{alias}.publication_name IN ({', '.join(['?'] * len(journals))})")
+        params.extend(journals)
+    return " AND ".join(clauses), params
+
+def search_filter(years=None, journals=None, subjects=None, countries=None, alias='p'):
+    #Like paper_filter but every part is optional, returns an empty clause when nothing is filtered
+    clauses, params = [], []
+    if years:
+        clauses.append(f"{alias}.year BETWEEN ? AND ?")
+        params.extend([int(years[0]), int(years[1])])
+    if journals:
+        clauses.append(f"{alias}.publication_name IN ({', '.join(['?'] * len(journals))})")
+        params.extend(journals)
+    for kind, names in (('subject', subjects), ('country', countries)):
+        if not names:
+            continue
+        entity, link, id_col = ENTITIES[kind]
+        clauses.append(f'''{alias}.paper_id IN (
+            SELECT l.paper_id FROM {link} l JOIN {entity} e ON e.{id_col} = l.{id_col}
+            WHERE e.name IN ({', '.join(['?'] * len(names))}))''')
+        params.extend(names)
+    return " AND ".join(clauses), params
+
+def filter_ids(con, years=None, journals=None, subjects=None, countries=None):
+    #Sorted paper ids matching the filters, used to restrict FAISS searches
+    where, params = search_filter(years, journals, subjects, countries)
+    query = f"SELECT p.paper_id FROM paper_data p {'WHERE ' + where if where else ''} ORDER BY p.paper_id;"
+    return np.fromiter((row[0] for row in con.execute(query, params)), dtype='int64')
+
+def year_range(con):
+    return con.execute("SELECT MIN(year), MAX(year) FROM paper_data;").fetchone()
+
+def journal_names(con):
+    query = "SELECT DISTINCT publication_name FROM paper_data WHERE publication_name IS NOT NULL ORDER BY publication_name;"
+    return [row[0] for row in con.execute(query)]
+
+def entity_names(con, kind):
+    entity, _, _ = ENTITIES[kind]
+    return [row[0] for row in con.execute(f"SELECT name FROM {entity} ORDER BY name;")]
+
+def has_aggregates(con):
+    #Written by data_preparation/build_aggregates.py
+    return con.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='agg_year_journal';").fetchone() is not None
+
+def entity_source(con, kind, journals):
+    #Rollup table, entity key and paper count for an entity, or the junction table when there are no rollups
+    entity, link, id_col = ENTITIES[kind]
+    if has_aggregates(con):
+        table = f"agg_{entity}" if journals else f"agg_{entity}_year"
+        return f"{table} p", "p.entity_id", "SUM(p.papers)"
+    return f"paper_data p JOIN {link} l ON l.paper_id = p.paper_id", f"l.{id_col}", "COUNT(*)"
+
+def top_entities(con, kind, years, journals, limit=10):
+    entity, _, id_col = ENTITIES[kind]
+    source, key, papers = entity_source(con, kind, journals)
+    where, params = paper_filter(years, journals)
+    query = f'''
+        SELECT e.name AS name, top.papers AS papers
+        FROM (
+            SELECT {key} AS entity_id, {papers} AS papers
+            FROM {source}
+            WHERE {where}
+            GROUP BY {key}
+            ORDER BY papers DESC
+            LIMIT ?
+        ) top
+        JOIN {entity} e ON e.{id_col} = top.entity_id
+        ORDER BY top.papers DESC
+    '''
+    return pd.read_sql_query(query, con, params=params + [limit])
+
+def entity_counts_by_year(con, kind, names, years, journals):
+    if not names:
+        return pd.DataFrame(columns=['year', 'name', 'papers'])
+
+    entity, _, id_col = ENTITIES[kind]
+    source, key, papers = entity_source(con, kind, journals)
+    where, params = paper_filter(years, journals)
+    query = f'''
+        SELECT p.year AS year, e.name AS name, {papers} AS papers
+        FROM {source}
+        JOIN {entity} e ON e.{id_col} = {key}
+        WHERE {where} AND e.name IN ({', '.join(['?'] * len(names))})
+        GROUP BY p.year, {key}
+        ORDER BY p.year
+    '''
+    return pd.read_sql_query(query, con, params=params + list(names))
+
+def rollup(con, table, columns, years, journals, group_by=None):
+    #Sums an aggregate table over the selected years and journals
+    where, params = paper_filter(years, journals)
+    query = f"SELECT {columns} FROM {table} p WHERE {where}"
+    if group_by:
+        query += f" GROUP BY {group_by} ORDER BY {group_by}"
+    return pd.read_sql_query(query, con, params=params)
+
+def overview(con, years, journals):
+    totals = rollup(con, 'agg_year_journal', "SUM(papers) AS papers, SUM(citations) AS citations, SUM(authors) AS authors",
+                    years, journals).iloc[0]
+    return {column: int(totals[column] or 0) for column in ('papers', 'citations', 'authors')}
+
+def yearly_counts(con, years, journals):
+    return rollup(con, 'agg_year_journal', "year, SUM(papers) AS Count", years, journals, 'year')
+
+def monthly_counts(con, years, journals):
+    df = rollup(con, 'agg_month', "month, SUM(papers) AS Count", years, journals, 'month')
+    df['date'] = pd.to_datetime(df['month'], format='%Y-%m', errors='coerce')
+    return df.dropna(subset=['date'])
+
+def team_sizes(con, years, journals):
+    return rollup(con, 'agg_team_size', "authors AS author_count, SUM(papers) AS papers", years, journals, 'authors')
+
+def citation_counts(con, years, journals):
+    return rollup(con, 'agg_citations', "citation_count, SUM(papers) AS papers", years, journals, 'citation_count')
+
+def journal_totals(con, years, journals):
+    return rollup(con, 'agg_year_journal', "publication_name, SUM(papers) AS papers, SUM(citations) AS citations",
+                  years, journals, 'publication_name')
+
+def journal_citation_counts(con, years, journals, names):
+    where, params = paper_filter(years, journals)
+    query = f'''
+        SELECT publication_name, citation_count, SUM(papers) AS papers
+        FROM agg_citations p
+        WHERE {where} AND publication_name IN ({', '.join(['?'] * len(names))})
+        GROUP BY publication_name, citation_count
+    '''
+    return pd.read_sql_query(query, con, params=params + list(names))
+
+def aggregate_year_range(con):
+    return con.execute("SELECT MIN(year), MAX(year) FROM agg_year_journal;").fetchone()
+
+def aggregate_journal_names(con, years):
+    query = '''
+        SELECT DISTINCT publication_name FROM agg_year_journal
+        WHERE year BETWEEN ? AND ? AND publication_name IS NOT NULL
+        ORDER BY publication_name
+    '''
+    return [row[0] for row in con.execute(query, (int(years[0]), int(years[1])))]
+
+def paper_rows(con, years, journals, limit=None, chunksize=None):
+    #Individual papers most cited first, citation_count can hold Scopus' text values so it is sorted as a number
+    where, params = paper_filter(years, journals)
+    query = f'''
+        SELECT p.title, p.doi, p.year, p.coverdate, p.publication_name, CAST(p.citation_count AS INTEGER) AS citation_count,
+               p.author_names, p.subject_areas, p.affiliations, p.countries
+        FROM paper_data p
+        WHERE {where}
+        ORDER BY CAST(p.citation_count AS INTEGER) DESC
+        LIMIT ?
+    '''
+    return pd.read_sql_query(query, con, params=params + [-1 if limit is None else limit], chunksize=chunksize)
+
+def papers(con, years, journals, limit):
+    #For the charts and tables that need rows, capped to keep pages small
+    return paper_rows(con, years, journals, limit)
+
+def papers_csv(con, years, journals, chunksize=50000):
+    #Every paper matching the filters, written in chunks so only one chunk of rows is in a DataFrame at a time
+    buffer = io.StringIO()
+    for i, chunk in enumerate(paper_rows(con, years, journals, chunksize=chunksize)):
+        #Nullable integers, a chunk holding a missing count would otherwise write its column as floats
+        chunk['citation_count'] = chunk['citation_count'].astype('Int64')
+        chunk.to_csv(buffer, index=False, header=(i == 0))
+    return buffer.getvalue().encode('utf-8')
@@ -0,0 +1,100 @@
+import math
+import os
+import re
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1200"))
+#Abstract tokens kept for the top source when the question leaves no room for it
+MIN_SOURCE_TOKENS = 60
+
+HEADER = "You are Jim, an AI research assistant. Use the following sources to answer the question.\n\n"
+FOOTER = "Question: {question}\n\nAnswer the question based on the above sources. If the information is not available, respond with 'Information not available in the provided sources.'"
+
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+STOPWORDS = set('''a an and are as at be by can do does for from has have how in into is it its of on or
+that the their there these this to was were what when where which who why will with about than then'''.split())
+
+def count_tokens(text):
+    #Rough estimate for Llama-style BPE, about 1.3 tokens per word or punctuation mark
+    return math.ceil(len(TOKEN_RE.findall(text)) * 1.3)
+
+def terms(text):
+    return {word for word in re.findall(r"\w+", text.lower()) if len(word) > 2 and word not in STOPWORDS}
+
+def dedupe_sources(sources):
+    seen, unique = set(), []
+    for source in sources:
+        key = (source.get('DOI') or '').lower() or re.sub(r"\W+", " ", source['title'].lower()).strip()
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append(source)
+    return unique
+
+def truncate(text, budget):
+    words = text.split()
+    while words and count_tokens(" ".join(words)) > budget:
+        words = words[:max(1, int(len(words) * 0.9))] if len(words) > 1 else []
+    return " ".join(words) + ("..." if words else "")
+
+def select_sentences(abstract, query_terms, budget):
+    #Keep the sentences sharing the most terms with the question, in their original order
+    sentences = [sentence for sentence in SENTENCE_RE.split(abstract.strip()) if sentence]
+    if count_tokens(abstract) <= budget:
+        return abstract
+
+    ranked = sorted(range(len(sentences)), key=lambda i: (-len(terms(sentences[i]) & query_terms), i))
+    chosen, used = [], 0
+    for i in ranked:
+        cost = count_tokens(sentences[i])
+        if used + cost <= budget:
+            chosen.append(i)
+            used += cost
+
+    if not chosen:
+        return truncate(sentences[ranked[0]], budget) if sentences else ""
+    return " ".join(sentences[i] for i in sorted(chosen))
+
+def format_source(number, title, abstract):
+    return f"Source {number}:\nTitle: {title}\nAbstract: {abstract}\n\n"
+
+def build_prompt(sources, question, budget=PROMPT_TOKEN_BUDGET):
+    #Returns the prompt text and its token accounting, sources are packed in rank order within the budget
+    unique = dedupe_sources(sources)
+    footer = FOOTER.format(question=question)
+    remaining = budget - count_tokens(HEADER) - count_tokens(footer)
+    query_terms = terms(question)
+
+    parts, used = [], []
+    for position, source in enumerate(unique):
+        title = source['title']
+        overhead = count_tokens(format_source(len(parts) + 1, title, ""))
+        #Each remaining source gets an equal share, unused space rolls over to the next one
+        share = remaining // (len(unique) - position) - overhead
+        if share <= 0 and not parts:
+            #The top source is always kept, trimmed to what is left, so a long question never leaves Jim without context
+            share = max(remaining - overhead, MIN_SOURCE_TOKENS)
+        if share <= 0:
+            continue
+
+        abstract = select_sentences(source['abstract'] or "", query_terms, share)
+        part = format_source(len(parts) + 1, title, abstract)
+        remaining -= count_tokens(part)
+        parts.append(part)
+        used.append(source)
+
+    prompt = HEADER + "".join(parts) + footer
+    estimated = count_tokens(prompt)
+    info = {
+        "estimated_tokens": estimated,
+        "budget": budget,
+        "over_budget": estimated > budget,
+        "sources_used": len(used),
+        "duplicates_dropped": len(sources) - len(unique),
+        "sources_dropped": len(unique) - len(used)
+    }
+    return prompt, used, info
@@ -0,0 +1,145 @@
+import atexit
+import hashlib
+import os
+import pickle
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_FILE = os.getenv("QUERY_CACHE_PATH", "../models/query_cache.db")
+CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "10000"))
+#0 disables expiry
+CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "0"))
+#Hits are written back to SQLite in batches of this many keys, so a restart reloads the recently used entries
+TOUCH_BATCH = 64
+
+def normalize_question(text):
+    #Case, spacing and trailing punctuation do not change what is being asked
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" ?.!")
+
+def make_key(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, bytes):
+            digest.update(part)
+        else:
+            digest.update(repr(part).encode('utf-8'))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+class LRUCache:
+    def __init__(self, name, maxsize=CACHE_SIZE, ttl=CACHE_TTL, path=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.touched = {}
+        self.lock = threading.RLock()
+
+        #Entries are written through to SQLite so the cache survives restarts
+        self.con = None
+        if path:
+            self.con = sqlite3.connect(path, check_same_thread=False)
+            self.con.execute("PRAGMA journal_mode=WAL;")
+            self.con.execute(f"CREATE TABLE IF NOT EXISTS {name} (key TEXT PRIMARY KEY, value BLOB, created REAL, used REAL);")
+            self.con.commit()
+            self.load()
+            #Hits since the last batch are written on a clean exit
+            atexit.register(self.flush)
+
+    def load(self):
+        rows = self.con.execute(f"SELECT key, value, created FROM {self.name} ORDER BY used DESC LIMIT ?;", (self.maxsize,)).fetchall()
+        for key, value, created in reversed(rows):
+            if not self.expired(created):
+                self.entries[key] = (pickle.loads(value), created)
+
+        #Drop whatever did not make it back into memory
+        self.con.execute(f"DELETE FROM {self.name} WHERE key NOT IN (SELECT key FROM {self.name} ORDER BY used DESC LIMIT ?);", (self.maxsize,))
+        if self.ttl > 0:
+            self.con.execute(f"DELETE FROM {self.name} WHERE created < ?;", (time.time() - self.ttl,))
+        self.con.commit()
+
+    def flush(self):
+        #Writes the last use of every entry hit since the previous flush
+        with self.lock:
+            if self.con is None or not self.touched:
+                return
+            self.con.executemany(f"UPDATE {self.name} SET used = ? WHERE key = ?;", [(used, key) for key, used in self.touched.items()])
+            self.con.commit()
+            self.touched.clear()
+
+    def expired(self, created):
+        return self.ttl > 0 and time.time() - created > self.ttl
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or self.expired(entry[1]):
+                if entry is not None:
+                    self.remove(key)
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if self.con is not None:
+                self.touched[key] = time.time()
+                if len(self.touched) >= TOUCH_BATCH:
+                    self.flush()
+            return entry[0]
+
+    def put(self, key, value):
+        now = time.time()
+        with self.lock:
+            self.entries[key] = (value, now)
+            self.entries.move_to_end(key)
+            evicted = []
+            while len(self.entries) > self.maxsize:
+                evicted.append(self.entries.popitem(last=False)[0])
+            self.evictions += len(evicted)
+            for k in evicted + [key]:
+                self.touched.pop(k, None)
+
+            if self.con is not None:
+                self.con.execute(f"INSERT OR REPLACE INTO {self.name} (key, value, created, used) VALUES (?, ?, ?, ?);",
+                                 (key, pickle.dumps(value), now, now))
+                self.con.executemany(f"DELETE FROM {self.name} WHERE key = ?;", [(k,) for k in evicted])
+                self.con.commit()
+
+    def remove(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.touched.pop(key, None)
+            if self.con is not None:
+                self.con.execute(f"DELETE FROM {self.name} WHERE key = ?;", (key,))
+                self.con.commit()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+#Keys for the three cache layers: question -> embedding, (embedding, k) -> neighbours, (question, sources, model) -> answer
+def embedding_key(question, model):
+    return make_key(normalize_question(question), model)
+
+def neighbor_key(vector, k, index_version=None, filters=None):
+    return make_key(vector.tobytes(), k, index_version, filters)
+
+def answer_key(question, source_ids, model):
+    return make_key(normalize_question(question), tuple(source_ids), model)
@@ -0,0 +1,33 @@
+import os
+
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+RETRIEVAL_URL = os.getenv("RETRIEVAL_URL", "http://127.0.0.1:8765")
+
+#One pooled session per process, reused by every Streamlit session
+session = requests.Session()
+
+def search_details(query, k=5, mode="hybrid", filters=None, rerank=None, timeout=30, trace_id=None):
+    #Full response: results plus mode, reranked flag, per-stage timings and the server's trace id
+    #filters: optional dict with years (start, end), journals, subjects and countries
+    payload = {"query": query, "k": k, "mode": mode}
+    if filters:
+        payload["filters"] = filters
+    if rerank is not None:
+        payload["rerank"] = rerank
+    headers = {"X-Trace-Id": trace_id} if trace_id else None
+    res = session.post(f"{RETRIEVAL_URL}/search", json=payload, timeout=timeout, headers=headers)
+    res.raise_for_status()
+    return res.json()
+
+def search(query, k=5, mode="hybrid", filters=None, rerank=None, timeout=30):
+    return search_details(query, k, mode, filters, rerank, timeout)["results"]
+
+def health(timeout=2):
+    try:
+        return session.get(f"{RETRIEVAL_URL}/health", timeout=timeout).ok
+    except requests.RequestException:
+        return False
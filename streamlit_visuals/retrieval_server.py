@@ -0,0 +1,447 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import faiss
+import numpy as np
+from sentence_transformers import SentenceTransformer, CrossEncoder
+from dotenv import load_dotenv
+
+from batcher import MicroBatcher, QueueFull
+from lexical_search import LexicalIndex, reciprocal_rank_fusion
+from metadata_store import MetadataStore, METADATA_FILE
+from metrics import registry, Trace
+from paper_queries import filter_ids
+from query_cache import LRUCache, CACHE_FILE, embedding_key, neighbor_key, make_key
+
+#Index parameters are set the same way the offline build stores them in the index file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_creation"))
+from build_index import set_search_params
+
+load_dotenv()
+
+MODEL_NAME = os.getenv("EMBEDDING_MODEL", "all-mpnet-base-v2")
+INDEX_FILE = os.getenv("FAISS_INDEX_PATH", "../models/faiss_scopus_index.idx")
+#0 keeps the search parameters stored in the index file by model_creation/build_index.py
+NPROBE = int(os.getenv("FAISS_NPROBE", "0"))
+EF_SEARCH = int(os.getenv("FAISS_EF_SEARCH", "0"))
+#Seconds between checks for a replaced index or metadata file, 0 disables reloading
+RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "30"))
+#Candidates taken from each of the dense and BM25 rankings before fusion
+FUSION_DEPTH = int(os.getenv("HYBRID_FUSION_DEPTH", "50"))
+SEARCH_MODES = ('hybrid', 'dense', 'lexical')
+#Small cross-encoder rescoring the fused candidates, empty disables reranking
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_DEPTH = int(os.getenv("RERANK_DEPTH", "50"))
+#Reranking is skipped while more searches than this are running, 0 never skips
+RERANK_MAX_ACTIVE = int(os.getenv("RERANK_MAX_ACTIVE", "4"))
+FILTER_FIELDS = ('journals', 'subjects', 'countries')
+#Filtered searches widen the IVF probe or HNSW beam 4x per retry until k results are found
+FILTER_RETRIES = 4
+#Concurrent queries are merged into one encode and one FAISS search per batch
+BATCH_SIZE = int(os.getenv("BATCH_MAX_SIZE", "16"))
+BATCH_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "10"))
+QUEUE_SIZE = int(os.getenv("BATCH_QUEUE_SIZE", "256"))
+#A query whose batch has not finished after this many seconds gets a 503 instead of holding its request thread
+BATCH_TIMEOUT = float(os.getenv("BATCH_TIMEOUT", "30"))
+MAX_K = 100
+
+def filtered_search(index, query_vector, k, allowed):
+    #Only vectors whose paper id is in allowed are scored, so a narrow filter still returns k results
+    if len(allowed) == 0:
+        return np.empty((1, 0), dtype='float32'), np.empty((1, 0), dtype='int64')
+
+    selector = faiss.IDSelectorBatch(len(allowed), faiss.swig_ptr(allowed))
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    ivf = faiss.try_extract_index_ivf(base)
+    want = min(k, len(allowed))
+
+    for attempt in range(FILTER_RETRIES):
+        scale = 4 ** attempt
+        if ivf is not None:
+            params = faiss.SearchParametersIVF()
+            params.nprobe = min(ivf.nprobe * scale, ivf.nlist)
+            exhausted = params.nprobe == ivf.nlist
+        elif isinstance(base, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = max(base.hnsw.efSearch, k) * scale
+            exhausted = params.efSearch >= index.ntotal
+        else:
+            params = faiss.SearchParameters()
+            exhausted = True
+        params.sel = selector
+
+        distances, indices = index.search(query_vector, k, params=params)
+        if (indices[0] >= 0).sum() >= want or exhausted:
+            break
+    return distances, indices
+
+def parse_filters(request):
+    #Normalized to a hashable tuple so it can be part of cache keys, None when nothing is filtered
+    filters = request.get("filters") or {}
+    if not isinstance(filters, dict):
+        raise ValueError("filters")
+
+    parsed = []
+    if filters.get("years"):
+        start, end = filters["years"]
+        parsed.append(('years', (int(start), int(end))))
+    for field in FILTER_FIELDS:
+        values = filters.get(field)
+        if values:
+            if isinstance(values, str):
+                values = [values]
+            parsed.append((field, tuple(sorted(str(value) for value in values))))
+    return tuple(parsed) or None
+
+class Retriever:
+    def __init__(self, model_name, index_path, metadata_path, nprobe=0, ef_search=0, cache_path=CACHE_FILE,
+                 rerank_model=RERANK_MODEL, rerank_depth=RERANK_DEPTH, rerank_max_active=RERANK_MAX_ACTIVE,
+                 batch_size=BATCH_SIZE, batch_wait_ms=BATCH_WAIT_MS, queue_size=QUEUE_SIZE, batch_timeout=BATCH_TIMEOUT):
+        #Loaded once per server process and shared by every client
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.index_path = index_path
+        self.metadata_path = metadata_path
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.index, self.store = None, None
+        self.index_version, self.store_version = None, None
+        self.reload()
+        self.encoder = MicroBatcher("encode", self.encode_batch, batch_size, batch_wait_ms, queue_size)
+        self.searcher = MicroBatcher("search", self.search_batch, batch_size, batch_wait_ms, queue_size)
+        self.batch_timeout = batch_timeout
+        registry.collect(self.metric_samples)
+
+        self.reranker = CrossEncoder(rerank_model) if rerank_model else None
+        self.rerank_depth = rerank_depth
+        self.rerank_max_active = rerank_max_active
+        self.rerank_lock = threading.Lock()
+        self.active = 0
+        self.active_lock = threading.Lock()
+
+        #Embeddings never go stale for a given model, neighbour lists expire with the cache TTL
+        self.embedding_cache = LRUCache("embedding_cache", ttl=0, path=cache_path)
+        self.neighbor_cache = LRUCache("neighbor_cache", path=cache_path)
+        #Id lists can be large and change with the paper store, so they are kept in memory only
+        self.filter_cache = LRUCache("filter_cache", maxsize=256)
+
+        self.lexical = LexicalIndex()
+        if not self.lexical.available:
+            print("No full-text index found, run data_preparation/build_fts.py for hybrid search. Serving dense results only")
+
+    def reload(self):
+        #update_index.py and build_metadata_store.py replace their files atomically, so a changed mtime means a complete new file
+        index_version = os.stat(self.index_path).st_mtime_ns
+        if index_version != self.index_version:
+            index = faiss.read_index(self.index_path)
+            set_search_params(index, self.nprobe, self.ef_search)
+            self.index, self.index_version = index, index_version
+            print(f"Loaded index with {index.ntotal} vectors", flush=True)
+
+        store_version = os.stat(self.metadata_path).st_mtime_ns
+        if store_version != self.store_version:
+            self.store, self.store_version = MetadataStore(self.metadata_path), store_version
+            print(f"Loaded metadata for {len(self.store)} papers", flush=True)
+
+    def watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.reload()
+            except Exception as e:
+                print("Reload failed, keeping the current index:", e, flush=True)
+
+    def encode_batch(self, queries):
+        vectors = self.model.encode(queries).astype('float32')
+        return [vectors[i:i + 1] for i in range(len(queries))]
+
+    def search_batch(self, requests):
+        #Requests are (index, vector, k); one search per index at the largest k, trimmed per request
+        results = [None] * len(requests)
+        groups = {}
+        for i, (index, _, _) in enumerate(requests):
+            groups.setdefault(id(index), []).append(i)
+        for members in groups.values():
+            index = requests[members[0]][0]
+            vectors = np.vstack([requests[i][1] for i in members])
+            k = max(requests[i][2] for i in members)
+            distances, indices = index.search(vectors, k)
+            for row, i in enumerate(members):
+                wanted = requests[i][2]
+                results[i] = (distances[row:row + 1, :wanted], indices[row:row + 1, :wanted])
+        return results
+
+    def embed(self, query):
+        key = embedding_key(query, self.model_name)
+        query_vector = self.embedding_cache.get(key)
+        if query_vector is None:
+            query_vector = self.encoder(query, timeout=self.batch_timeout)
+            self.embedding_cache.put(key, query_vector)
+        return query_vector
+
+    def allowed_ids(self, filters, version):
+        key = make_key(filters, version)
+        ids = self.filter_cache.get(key)
+        if ids is None:
+            ids = filter_ids(self.lexical.connection(), **dict(filters))
+            self.filter_cache.put(key, ids)
+        return ids
+
+    def neighbors(self, query_vector, k, filters=None):
+        #Keyed on the index version so a swapped index never serves old neighbours
+        index, version = self.index, self.index_version
+        key = neighbor_key(query_vector, k, version, filters)
+        cached = self.neighbor_cache.get(key)
+        if cached is None:
+            if filters:
+                distances, indices = filtered_search(index, query_vector, k, self.allowed_ids(filters, version))
+            else:
+                distances, indices = self.searcher((index, query_vector, k), timeout=self.batch_timeout)
+            found = indices[0] >= 0
+            cached = (indices[0][found], distances[0][found])
+            self.neighbor_cache.put(key, cached)
+        return cached
+
+    def cache_stats(self):
+        return {"embedding": self.embedding_cache.stats(), "neighbor": self.neighbor_cache.stats(),
+                "filter": self.filter_cache.stats()}
+
+    def batch_stats(self):
+        return {"encode": self.encoder.stats(), "search": self.searcher.stats()}
+
+    def metric_samples(self):
+        #Cache and batcher counters are read from their own stats at scrape time
+        samples = [("active_searches", "gauge", {}, self.active), ("index_papers", "gauge", {}, int(self.index.ntotal))]
+        for cache, stats in self.cache_stats().items():
+            samples += [("cache_hits_total", "counter", {"cache": cache}, stats["hits"]),
+                        ("cache_misses_total", "counter", {"cache": cache}, stats["misses"]),
+                        ("cache_entries", "gauge", {"cache": cache}, stats["size"])]
+        for batcher, stats in self.batch_stats().items():
+            samples += [("batches_total", "counter", {"batcher": batcher}, stats["batches"]),
+                        ("batch_items_total", "counter", {"batcher": batcher}, stats["items"]),
+                        ("batch_rejected_total", "counter", {"batcher": batcher}, stats["rejected"]),
+                        ("batch_timed_out_total", "counter", {"batcher": batcher}, stats["timed_out"]),
+                        ("batch_queued", "gauge", {"batcher": batcher}, stats["queued"])]
+        return samples
+
+    def should_rerank(self, requested):
+        if self.reranker is None or requested is False:
+            return False
+        #Under load the cross-encoder is the first thing to go, fused ranks are still returned
+        return not self.rerank_max_active or self.active <= self.rerank_max_active
+
+    def rerank(self, query, candidates):
+        #All query and paper pairs are scored in one batch
+        pairs = [(query, f"{paper['title'] or ''}. {paper['abstract'] or ''}") for _, paper in candidates]
+        with self.rerank_lock:
+            scores = self.reranker.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+        order = sorted(range(len(candidates)), key=lambda i: scores[i], reverse=True)
+        return [candidates[i] for i in order], {candidates[i][0]: float(scores[i]) for i in order}
+
+    def search(self, query, k, mode='hybrid', filters=None, rerank=None):
+        #Returns the results and a per-stage latency breakdown in milliseconds
+        with self.active_lock:
+            self.active += 1
+        try:
+            return self.run_search(query, k, mode, filters, rerank)
+        finally:
+            with self.active_lock:
+                self.active -= 1
+
+    def run_search(self, query, k, mode, filters, rerank):
+        store = self.store
+        timings = {}
+        mark = time.perf_counter()
+
+        def lap(stage):
+            nonlocal mark
+            now = time.perf_counter()
+            timings[stage] = (now - mark) * 1000
+            mark = now
+
+        if mode != 'dense' and not self.lexical.available:
+            mode = 'dense'
+        reranked = self.should_rerank(rerank)
+        #The cross-encoder gets a deeper candidate list than the caller asked for
+        fetch = max(k, self.rerank_depth) if reranked else k
+
+        dense_ids, distances = [], []
+        if mode != 'lexical':
+            query_vector = self.embed(query)
+            lap("embed_ms")
+            depth = fetch if mode == 'dense' else max(fetch, FUSION_DEPTH)
+            dense_ids, distances = self.neighbors(query_vector, depth, filters)
+            lap("dense_ms")
+        distance_of = {int(idx): float(distance) for idx, distance in zip(dense_ids, distances)}
+
+        lexical = []
+        if mode != 'dense':
+            lexical = self.lexical.search(query, fetch if mode == 'lexical' else max(fetch, FUSION_DEPTH), **dict(filters or ()))
+            lap("lexical_ms")
+        bm25_of = dict(lexical)
+
+        if mode == 'hybrid':
+            #Reciprocal rank fusion only uses ranks, so L2 distances and BM25 scores need no calibration
+            ranked = reciprocal_rank_fusion([list(distance_of), list(bm25_of)])
+        else:
+            ranked = [(idx, None) for idx in (distance_of if mode == 'dense' else bm25_of)]
+        ranked = ranked[:fetch]
+        score_of = dict(ranked)
+
+        #Only the candidate rows are read from the memory-mapped store
+        papers = store.hydrate([idx for idx, _ in ranked])
+        candidates = [(idx, paper) for (idx, _), paper in zip(ranked, papers) if paper is not None]
+        lap("hydrate_ms")
+
+        rerank_of = {}
+        if reranked and candidates:
+            candidates, rerank_of = self.rerank(query, candidates)
+            lap("rerank_ms")
+
+        results = []
+        for idx, paper in candidates[:k]:
+            results.append({
+                "id": int(idx),
+                "distance": distance_of.get(idx),
+                "bm25": bm25_of.get(idx),
+                "score": score_of.get(idx),
+                "rerank_score": rerank_of.get(idx),
+                "title": paper['title'] or "",
+                "DOI": paper['doi'] or "",
+                "abstract": paper['abstract'] or ""
+            })
+        return results, {"mode": mode, "reranked": bool(rerank_of), "candidates": len(candidates), "timings": timings}
+
+class RetrievalHandler(BaseHTTPRequestHandler):
+    retriever = None
+
+    def send_json(self, status, payload, headers=None):
+        self.send_body(status, json.dumps(payload).encode('utf-8'), "application/json", headers)
+
+    def send_body(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            index = self.retriever.index
+            self.send_json(200, {"status": "ok", "papers": int(index.ntotal), "index": type(index).__name__,
+                                 "lexical": self.retriever.lexical.available,
+                                 "rerank": self.retriever.reranker is not None})
+        elif self.path == "/stats":
+            self.send_json(200, {"cache": self.retriever.cache_stats(), "batching": self.retriever.batch_stats()})
+        elif self.path == "/metrics":
+            self.send_body(200, registry.render().encode('utf-8'), "text/plain; version=0.0.4")
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/search":
+            self.send_json(404, {"error": "not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            query = str(request["query"]).strip()
+            k = min(max(int(request.get("k", 5)), 1), MAX_K)
+            mode = request.get("mode", "hybrid")
+            if mode not in SEARCH_MODES:
+                raise ValueError(mode)
+            filters = parse_filters(request)
+            rerank = request.get("rerank")
+            if rerank is not None and not isinstance(rerank, bool):
+                raise ValueError(rerank)
+        except (KeyError, ValueError, TypeError):
+            self.send_json(400, {"error": "expected JSON body with 'query' and optional 'k', 'mode' (hybrid, dense or lexical), "
+                                          "'filters' (years, journals, subjects, countries) and 'rerank' (true or false)"})
+            return
+
+        if not query:
+            self.send_json(400, {"error": "query must not be empty"})
+            return
+
+        #Ask Jim passes its own trace id, so both sides of a question share one id in the trace log
+        trace = Trace("search", self.headers.get("X-Trace-Id"), mode=mode, k=k, filtered=bool(filters))
+        try:
+            results, info = self.retriever.search(query, k, mode, filters, rerank)
+        except QueueFull as e:
+            registry.inc("rejected_searches_total")
+            self.send_json(503, {"error": f"server is overloaded ({e}), retry shortly"}, {"Retry-After": "1"})
+            return
+        except Exception as e:
+            #Anything else would drop the connection without a response, the client gets a JSON error instead
+            print(f"Search failed for {query!r}:", flush=True)
+            traceback.print_exc()
+            registry.inc("failed_searches_total")
+            self.send_json(500, {"error": f"search failed ({type(e).__name__}: {e})"})
+            return
+        for stage, ms in info["timings"].items():
+            trace.add(stage[:-3], ms / 1000)
+        registry.inc("searches_total", mode=info["mode"], reranked=str(info["reranked"]).lower())
+        registry.inc("retrieved_results_total", len(results))
+        registry.inc("retrieved_candidates_total", info["candidates"])
+        record = trace.finish(served_mode=info["mode"], reranked=info["reranked"], candidates=info["candidates"],
+                              results=len(results))
+        self.send_json(200, {"results": results, "took_ms": record["total_ms"], "trace_id": trace.trace_id, **info})
+
+    def log_message(self, format, *args):
+        pass
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve Ask Jim paper retrieval over a JSON HTTP API")
+    parser.add_argument("--host", default=os.getenv("RETRIEVAL_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("RETRIEVAL_PORT", "8765")))
+    parser.add_argument("--index", default=INDEX_FILE)
+    parser.add_argument("--metadata", default=METADATA_FILE)
+    parser.add_argument("--model", default=MODEL_NAME)
+    parser.add_argument("--nprobe", type=int, default=NPROBE, help="IVF lists scanned per query, 0 keeps the index default")
+    parser.add_argument("--ef-search", type=int, default=EF_SEARCH, help="HNSW search depth, 0 keeps the index default")
+    parser.add_argument("--rerank-model", default=RERANK_MODEL, help="cross-encoder for reranking, empty disables it")
+    parser.add_argument("--rerank-depth", type=int, default=RERANK_DEPTH, help="candidates scored by the cross-encoder")
+    parser.add_argument("--rerank-max-active", type=int, default=RERANK_MAX_ACTIVE,
+                        help="skip reranking while more searches than this are running, 0 never skips")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="most queries merged into one encode or search")
+    parser.add_argument("--batch-wait-ms", type=float, default=BATCH_WAIT_MS, help="longest a query waits for others to batch with")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE, help="queued queries before new ones get a 503")
+    parser.add_argument("--batch-timeout", type=float, default=BATCH_TIMEOUT,
+                        help="seconds a query waits for its batch before it gets a 503")
+    parser.add_argument("--reload-interval", type=float, default=RELOAD_INTERVAL,
+                        help="seconds between checks for a replaced index or metadata file, 0 disables")
+    parser.add_argument("--cache", default=CACHE_FILE, help="SQLite file persisting the query caches, empty keeps them in memory only")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+
+    print("Loading model, index and paper metadata...")
+    start = time.perf_counter()
+    RetrievalHandler.retriever = Retriever(args.model, args.index, args.metadata, args.nprobe, args.ef_search, args.cache,
+                                           args.rerank_model, args.rerank_depth, args.rerank_max_active,
+                                           args.batch_size, args.batch_wait_ms, args.queue_size, args.batch_timeout)
+    print(f"Ready in {time.perf_counter() - start:.1f}s, serving on http://{args.host}:{args.port}")
+
+    if args.reload_interval > 0:
+        threading.Thread(target=RetrievalHandler.retriever.watch, args=(args.reload_interval,), daemon=True).start()
+
+    server = ThreadingHTTPServer((args.host, args.port), RetrievalHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+import streamlit as st
+
+from metadata_store import MetadataStore, METADATA_FILE
+
+#Cells per axis of the spatial index over the projection
+GRID_SIZE = 256
+#Viewports holding more papers than this are drawn as a density image
+POINT_LIMIT = int(os.getenv("CLUSTER_POINT_LIMIT", "5000"))
+DENSITY_BINS = 200
+
+class ClusterMap:
+    #2-D projection with a uniform grid index: papers sorted by cell, so a viewport maps to contiguous row runs
+    def __init__(self, store, grid=GRID_SIZE):
+        self.store = store
+        frame = store.to_pandas(['x', 'y', 'clear_label', 'cluster'])
+        placed = frame['x'].notna() & frame['y'].notna()
+        self.rows = np.flatnonzero(placed.to_numpy())
+        self.x = frame['x'].to_numpy()[self.rows]
+        self.y = frame['y'].to_numpy()[self.rows]
+        #Projected before clustering has run, every paper falls in one unlabelled category
+        if 'clear_label' in frame:
+            labels = frame['clear_label']
+        elif 'cluster' in frame:
+            labels = frame['cluster'].map(lambda cluster: f"Cluster {cluster:.0f}", na_action='ignore')
+        else:
+            labels = pd.Series(None, index=frame.index, dtype='object')
+        self.labels = labels.fillna("Unlabelled").to_numpy()[self.rows]
+
+        self.grid = grid
+        self.bounds = (self.x.min(), self.x.max(), self.y.min(), self.y.max())
+        cells = self.cell(self.x, self.y)
+        order = np.argsort(cells, kind='stable')
+        self.x, self.y, self.labels, self.rows = self.x[order], self.y[order], self.labels[order], self.rows[order]
+        self.cell_starts = np.searchsorted(cells[order], np.arange(grid * grid + 1))
+
+        #Label positions are fixed, they annotate the density view at any zoom
+        centers = pd.DataFrame({'x': self.x, 'y': self.y, 'label': self.labels}).groupby('label').median()
+        self.label_centers = centers.reset_index()
+
+    def __len__(self):
+        return len(self.x)
+
+    def cell_coords(self, x, y):
+        x_min, x_max, y_min, y_max = self.bounds
+        cx = ((np.asarray(x) - x_min) / max(x_max - x_min, 1e-12) * self.grid).astype('int64')
+        cy = ((np.asarray(y) - y_min) / max(y_max - y_min, 1e-12) * self.grid).astype('int64')
+        return np.clip(cx, 0, self.grid - 1), np.clip(cy, 0, self.grid - 1)
+
+    def cell(self, x, y):
+        cx, cy = self.cell_coords(x, y)
+        return cy * self.grid + cx
+
+    def query(self, viewport):
+        #Indices of the papers inside viewport (x0, x1, y0, y1), None means everything
+        if viewport is None:
+            return np.arange(len(self))
+        x0, x1, y0, y1 = viewport
+        (cx0, cx1), (cy0, cy1) = self.cell_coords([x0, x1], [y0, y1])
+        runs = [np.arange(self.cell_starts[row * self.grid + cx0], self.cell_starts[row * self.grid + cx1 + 1])
+                for row in range(cy0, cy1 + 1)]
+        candidates = np.concatenate(runs) if runs else np.empty(0, dtype='int64')
+        #Edge cells are only partly inside the viewport
+        inside = ((self.x[candidates] >= x0) & (self.x[candidates] <= x1) &
+                  (self.y[candidates] >= y0) & (self.y[candidates] <= y1))
+        return candidates[inside]
+
+    def density(self, viewport, bins=DENSITY_BINS):
+        found = self.query(viewport)
+        x0, x1, y0, y1 = viewport or self.bounds
+        counts, x_edges, y_edges = np.histogram2d(self.x[found], self.y[found], bins=bins, range=[[x0, x1], [y0, y1]])
+        return counts.T, (x_edges[:-1] + x_edges[1:]) / 2, (y_edges[:-1] + y_edges[1:]) / 2
+
+    def points(self, found):
+        #Hover metadata is only read for the papers actually drawn
+        frame = self.store.take(self.rows[found], ['title', 'doi'])
+        frame['x'], frame['y'], frame['clear_label'] = self.x[found], self.y[found], self.labels[found]
+        return frame
+
+@st.cache_resource(max_entries=1)
+def build_cluster_map(path, version):
+    #One map per Streamlit process and store version, shared by clusters.py and the eda.py clusters tab
+    store = MetadataStore(path)
+    if 'x' not in store.columns:
+        return None
+    return ClusterMap(store)
+
+def load_cluster_map(path=METADATA_FILE):
+    #The store's mtime is part of the cache key, a rebuilt metadata.arrow replaces the cached map
+    if not os.path.exists(path):
+        return None
+    return build_cluster_map(path, os.stat(path).st_mtime_ns)
+
+def axis_style(fig):
+    fig.update_layout(
+        xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+        yaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+        dragmode='select'
+    )
+    return fig
+
+def density_figure(cluster_map, viewport, title):
+    z, xs, ys = cluster_map.density(viewport)
+    fig = go.Figure(go.Heatmap(x=xs, y=ys, z=np.log1p(z), colorscale='Viridis', showscale=False,
+                               customdata=z, hovertemplate="%{customdata:.0f} papers<extra></extra>"))
+    centers = cluster_map.label_centers
+    if viewport is not None:
+        x0, x1, y0, y1 = viewport
+        centers = centers[centers['x'].between(x0, x1) & centers['y'].between(y0, y1)]
+    fig.add_trace(go.Scatter(x=centers['x'], y=centers['y'], text=centers['label'], mode='text',
+                             textfont=dict(color='white'), hoverinfo='skip'))
+    fig.update_layout(title=title, showlegend=False)
+    return axis_style(fig)
+
+def points_figure(cluster_map, found, title):
+    fig = px.scatter(
+        cluster_map.points(found),
+        x='x',
+        y='y',
+        hover_name='title', # Show title on hover
+        hover_data={'x': False, 'y': False, 'doi': True, 'clear_label': True},
+        title=title,
+        color='clear_label',
+        opacity=0.5
+    )
+    return axis_style(fig)
+
+def selected_box(event):
+    boxes = (event or {}).get('selection', {}).get('box') or []
+    if not boxes:
+        return None
+    x0, x1 = sorted(boxes[0]['x'][:2])
+    y0, y1 = sorted(boxes[0]['y'][:2])
+    return (x0, x1, y0, y1)
+
+def render_cluster_map(key, title="Semantic Clusters of Research Papers with Labels"):
+    #Density image until the viewport is small enough to send individual points, box select zooms in
+    cluster_map = load_cluster_map()
+    if cluster_map is None or not len(cluster_map):
+        st.info("The metadata store has no projection yet, run the clustering steps in model_creation and rebuild it.")
+        return
+
+    state_key = f"{key}_viewport"
+    viewport = st.session_state.get(state_key)
+    if viewport is not None and st.button("Reset view", key=f"{key}_reset"):
+        viewport = st.session_state[state_key] = None
+
+    found = cluster_map.query(viewport)
+    if len(found) <= POINT_LIMIT:
+        fig = points_figure(cluster_map, found, title)
+        st.caption(f"Showing all {len(found):,} papers in view")
+    else:
+        fig = density_figure(cluster_map, viewport, title)
+        st.caption(f"{len(found):,} papers in view, drawn as density. Box-select an area to zoom in; "
+                   f"individual papers appear below {POINT_LIMIT:,}")
+
+    event = st.plotly_chart(fig, use_container_width=True, key=f"{key}_{viewport}", on_select="rerun", selection_mode="box")
+    box = selected_box(event)
+    if box is not None and box != viewport:
+        st.session_state[state_key] = box
+        st.rerun()